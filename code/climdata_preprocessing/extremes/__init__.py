@@ -0,0 +1,9 @@
+## SHARED CODE FOR THE CLIMATE EXTREMES INDICATORS
+
+# Library used by the indicators_*.py scripts in this folder. The scripts remain the entry points,
+# this package holds the computations they have in common.
+
+from .engine import INDICATORS, season_stat
+from .grid import cell_series, cells_to_grid, to_cells, to_grid
+from .runlength import longest_run, run_lengths
+from .seasons import aggr_season, crop_season, union_season
@@ -0,0 +1,215 @@
+## BENCHMARK WITH SYNTHETIC INPUTS
+
+# Measures the speed of the indicator computation without the GSWP3-W5E5 data: synthetic daily tasmax and pr cubes,
+# crop calendars (planting_day, maturity_day) and crop data tables (as the dat_<crop> tables of
+# crop_specific_data.RData) are generated for a grid of any size. The growing seasons are then resolved as in a real
+# run (crop specific and crop aggregated) and the steps of the engine are timed on them:
+# - percentile: the thresholds of all grid cells (engine.season_thresholds)
+# - extreme_length: the longest runs of extreme days over the record (runlength.longest_run)
+# - season_stat: all indicators of a family, with the thresholds given (engine.season_stat, or the one-pass kernel of
+#   kernel.py with --backend numba)
+# Run from code/climdata_preprocessing, e.g.
+#   python -m extremes.bench --lat 40 --lon 80 --years 1981 2019 --output bench.json
+# The timings of an earlier run (--output) can be given with --baseline to print the ratio to them.
+
+import argparse
+import json
+import time as timer
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .data import CROP_NAMES, combine_cropdat
+from .engine import INDICATORS, exceeds, indicator_spec, season_mask, season_thresholds
+from .kernel import BACKENDS, backend_stat
+from .runlength import longest_run
+from .seasons import aggr_season, crop_season, union_season
+from .timeindex import TimeIndex
+
+
+def synthetic_climate(n_lat, n_lon, first_year, last_year, seed=0):
+    # INPUT:
+    # - n_lat, n_lon: size of the grid (0.5 degree, as GSWP3-W5E5, from 89.75 N southwards and from 179.75 W eastwards)
+    # - first_year, last_year: years of the daily record
+    # - seed: seed of the random numbers
+    # OUTPUT:
+    # - dictionary {variable: xarray dataset (time, lat, lon)} with float32 tasmax (K, with a seasonal cycle) and
+    #   pr (kg m-2 s-1, about 60% dry days)
+
+    rng = np.random.default_rng(seed)
+    time = pd.date_range(f"{first_year}-01-01", f"{last_year}-12-31", freq="D")
+    lats = 89.75 - 0.5 * np.arange(n_lat)
+    lons = -179.75 + 0.5 * np.arange(n_lon)
+    shape = (len(time), n_lat, n_lon)
+
+    cycle = 10 * np.cos(2 * np.pi * (time.dayofyear.values - 200) / 365)[:, None, None]
+    tasmax = (295 + cycle + rng.normal(0, 4, shape)).astype(np.float32)
+    pr = np.where(rng.random(shape) < 0.6, 0, rng.gamma(0.8, 5e-5, shape)).astype(np.float32)
+
+    coords = {"time": time, "lat": lats, "lon": lons}
+    return {
+        "tasmax": xr.Dataset({"tasmax": (("time", "lat", "lon"), tasmax)}, coords=coords),
+        "pr": xr.Dataset({"pr": (("time", "lat", "lon"), pr)}, coords=coords),
+    }
+
+
+def synthetic_calendars(lats, lons, crop_names=CROP_NAMES, seed=0):
+    # INPUT:
+    # - lats, lons: coordinates of the grid
+    # - crop_names: crops
+    # - seed: seed of the random numbers
+    # OUTPUT:
+    # - season_firr_dict, season_noirr_dict: dictionaries {crop: xarray dataset (lat, lon) with planting_day and
+    #   maturity_day}, in the layout of the ISIMIP crop calendars. About a quarter of the seasons span two calendar years.
+
+    rng = np.random.default_rng(seed)
+    shape = (len(lats), len(lons))
+    season_firr_dict, season_noirr_dict = {}, {}
+    for crop in crop_names:
+        for calendars in (season_firr_dict, season_noirr_dict):
+            planting = rng.integers(1, 366, shape)
+            maturity = (planting + rng.integers(90, 200, shape) - 1) % 365 + 1
+            calendars[crop] = xr.Dataset(
+                {"planting_day": (("lat", "lon"), planting.astype(float)), "maturity_day": (("lat", "lon"), maturity.astype(float))},
+                coords={"lat": lats, "lon": lons}
+            )
+    return season_firr_dict, season_noirr_dict
+
+
+def synthetic_cropdat(lats, lons, crop_names=CROP_NAMES, cropland=0.4, seed=0):
+    # INPUT:
+    # - lats, lons: coordinates of the grid
+    # - crop_names: crops
+    # - cropland: share of the grid cells where a crop is grown
+    # - seed: seed of the random numbers
+    # OUTPUT:
+    # - dictionary {crop: dataframe with lat, lon, rain_area and irr_area}, one row per grid cell where the crop is
+    #   grown, as the dat_<crop> tables of crop_specific_data.RData (see data.load_cropdat)
+
+    rng = np.random.default_rng(seed)
+    lat, lon = (grid.ravel() for grid in np.meshgrid(lats, lons, indexing="ij"))
+    cropdat_dict = {}
+    for crop in crop_names:
+        grown = rng.random(len(lat)) < cropland
+        n = grown.sum()
+        # rainfed only, irrigated only or both
+        kind = rng.integers(0, 3, n)
+        area = rng.gamma(2, 500, (2, n))
+        cropdat_dict[crop] = pd.DataFrame({
+            "lat": lat[grown], "lon": lon[grown],
+            "rain_area": np.where(kind != 1, area[0], 0), "irr_area": np.where(kind != 0, area[1], 0),
+        })
+    return cropdat_dict
+
+
+def synthetic_seasons(lats, lons, crops=(*CROP_NAMES, "aggr"), cropland=0.4, seed=0, union=False):
+    # Growing seasons {crop: (cells, start_day, end_day, day_mask)} (as run.load_seasons, with the union season of
+    # "aggr" if union) resolved from synthetic crop calendars and crop data tables
+    season_firr_dict, season_noirr_dict = synthetic_calendars(lats, lons, seed=seed)
+    cropdat_dict = synthetic_cropdat(lats, lons, cropland=cropland, seed=seed)
+    seasons = {}
+    for crop in crops:
+        day_mask = None
+        if crop == "aggr":
+            cropdat = combine_cropdat(cropdat_dict)
+            if union:
+                start_day, end_day, day_mask = union_season(season_firr_dict, season_noirr_dict, cropdat, CROP_NAMES)
+            else:
+                start_day, end_day = aggr_season(season_firr_dict, season_noirr_dict, cropdat, CROP_NAMES)
+        else:
+            cropdat = cropdat_dict[crop]
+            start_day, end_day = crop_season(season_firr_dict[crop], season_noirr_dict[crop], cropdat)
+        seasons[crop] = (cropdat[["lat", "lon"]].reset_index(drop=True), start_day, end_day, day_mask)
+    return seasons
+
+
+def _best_time(function, repeat):
+    # Shortest wall time of repeat calls (seconds) and the result of the last one
+    best = np.inf
+    for _ in range(repeat):
+        start = timer.perf_counter()
+        result = function()
+        best = min(best, timer.perf_counter() - start)
+    return best, result
+
+
+def time_steps(climate, seasons, families=tuple(INDICATORS), repeat=3, backend="numpy"):
+    # INPUT:
+    # - climate: dictionary {variable: xarray dataset} (see synthetic_climate)
+    # - seasons: dictionary {crop: (cells, start_day, end_day, day_mask)} (see synthetic_seasons)
+    # - families: indicator families
+    # - repeat: number of runs of every step (the shortest is kept)
+    # - backend: engine of the season_stat step (see kernel.py)
+    # OUTPUT:
+    # - list of dictionaries with the mode (crop or aggr), family, step, number of grid cells and days, and the time
+    #   in seconds
+
+    season_stat = backend_stat(backend)
+    results = []
+    for crop, (cells, start_day, end_day, day_mask) in seasons.items():
+        for family in families:
+            variable = indicator_spec(family)["variable"]
+            data = climate[variable][variable]
+            points = dict(lat=xr.DataArray(cells["lat"].values, dims="cell"), lon=xr.DataArray(cells["lon"].values, dims="cell"))
+            values = data.sel(**points).transpose("time", "cell").values
+            time = TimeIndex(data["time"].values)
+
+            seconds, thresholds = _best_time(lambda: season_thresholds(values, time, start_day, end_day, family, day_mask=day_mask), repeat)
+            timings = {"percentile": seconds}
+
+            in_season = season_mask(time.dayofyear, start_day, end_day, day_mask)
+            binary = exceeds(values, thresholds[0], indicator_spec(family)["extremes"][0][3]) & in_season
+            timings["extreme_length"], _ = _best_time(lambda: longest_run(binary), repeat)
+
+            timings["season_stat"], _ = _best_time(
+                lambda: season_stat(values, time, start_day, end_day, family, thresholds=thresholds, day_mask=day_mask), repeat)
+
+            for step, seconds in timings.items():
+                results.append({"mode": "aggr" if crop == "aggr" else "crop", "crop": crop, "family": family, "step": step,
+                                "cells": len(cells), "days": len(time), "seconds": seconds})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m extremes.bench", description="Time the indicator computation on synthetic inputs.")
+    parser.add_argument("--lat", type=int, default=40, help="number of latitude rows of the synthetic grid")
+    parser.add_argument("--lon", type=int, default=80, help="number of longitude columns of the synthetic grid")
+    parser.add_argument("--years", nargs=2, type=int, default=(1981, 2019), metavar=("FIRST", "LAST"))
+    parser.add_argument("--cropland", type=float, default=0.4, help="share of the grid cells where a crop is grown")
+    parser.add_argument("--crops", nargs="+", choices=(*CROP_NAMES, "aggr"), default=("mai", "aggr"),
+                        help="crop specific and/or aggregated (aggr) growing seasons (default: mai aggr)")
+    parser.add_argument("--aggr-union", action="store_true", help="union season of the crop aggregate (see seasons.union_season)")
+    parser.add_argument("--families", nargs="+", choices=tuple(INDICATORS), default=tuple(INDICATORS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every step (the shortest is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy", help="engine of the season_stat step")
+    parser.add_argument("--output", help="save the timings as a json file")
+    parser.add_argument("--baseline", help="json file of an earlier run (--output) to compare with")
+    args = parser.parse_args(argv)
+
+    climate = synthetic_climate(args.lat, args.lon, *args.years, seed=args.seed)
+    lats, lons = climate["tasmax"]["lat"].values, climate["tasmax"]["lon"].values
+    seasons = synthetic_seasons(lats, lons, args.crops, args.cropland, args.seed, args.aggr_union)
+    results = time_steps(climate, seasons, args.families, args.repeat, args.backend)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = {(r["crop"], r["family"], r["step"]): r["seconds"] for r in json.load(file)["results"]}
+
+    print(f"{'crop':<6} {'family':<8} {'step':<15} {'cells':>7} {'seconds':>9} {'cells/s':>10}" + ("  vs baseline" if baseline else ""))
+    for r in results:
+        line = f"{r['crop']:<6} {r['family']:<8} {r['step']:<15} {r['cells']:>7} {r['seconds']:>9.3f} {r['cells'] / r['seconds']:>10.0f}"
+        before = baseline.get((r["crop"], r["family"], r["step"]))
+        if before:
+            line += f"  {r['seconds'] / before:.2f}x"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}, "results": results}, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+## ON-DISK CACHE OF INTERMEDIATE RESULTS
+
+# Intermediate results that are expensive to compute and shared by several indicator runs (e.g. the growing season
+# table of a crop) are saved as netcdf files in the cache folder. Every cached file stores a fingerprint of its input
+# files (path in the repository, size and modification time); when an input file changes, the fingerprint no longer
+# matches and the cached result is computed again. The same repository given as a relative or absolute path, or moved
+# elsewhere, keeps its cache.
+
+import hashlib
+import os
+
+import xarray as xr
+
+CACHE_DIR = "GGCMI-validation/data/processed/extremes_indicators/cache"
+
+
+def fingerprint(repo_path, paths, **settings):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - paths: input files of a cached result
+    # - settings: other values the cached result depends on (e.g. the percentile)
+    # OUTPUT:
+    # - hexadecimal string that changes whenever an input file or setting changes
+
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = path.stat()
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(repo_path))
+        digest.update(f"{relative}|{stat.st_size}|{stat.st_mtime_ns};".encode())
+    for name in sorted(settings):
+        digest.update(f"{name}={settings[name]};".encode())
+    return digest.hexdigest()
+
+
+def cache_path(repo_path, name):
+    # Netcdf file of a cached result
+    return repo_path / CACHE_DIR / f"{name}.nc"
+
+
+def load_cached(path, key):
+    # Cached dataset if it exists and was computed from the same inputs (same fingerprint), otherwise None
+    if not path.exists():
+        return None
+    cached = xr.load_dataset(path)
+    if cached.attrs.get("inputs") != key:
+        return None
+    return cached
+
+
+def save_cached(dataset, path, key):
+    # Save a dataset in the cache together with the fingerprint of its inputs
+    path.parent.mkdir(parents=True, exist_ok=True)
+    dataset.attrs["inputs"] = key
+    dataset.to_netcdf(path)
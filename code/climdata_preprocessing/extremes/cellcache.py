@@ -0,0 +1,120 @@
+## CELL-MAJOR CACHE OF THE DAILY CLIMATE DATA
+
+# The GSWP3-W5E5 files are time-major: the daily series of one grid cell is spread over every daily slice of the
+# files. This optional one-time conversion writes the daily series of all cropland grid cells (of all crops) to one
+# cell-major (cell, time) binary file per climate variable, which is memory-mapped by later runs: the series of a grid
+# cell, and of a latitude band of grid cells, is then one contiguous block of the file. Every indicator run (hot and
+# dry/wet, all crops and the crop aggregate) reads from the same cache.
+
+# Files in the cache folder (see cache.py), per climate variable:
+# - climate_<variable>.npy: numpy array (cell, time) in the dtype of the climate files (float32 for GSWP3-W5E5), so the
+#   indicators are identical to the ones computed from the netcdf files
+# - climate_<variable>.nc: lat and lon of every row and the time stamps, with the fingerprint of the climate files.
+#   It is written last, so an interrupted conversion is not used.
+# The cache is converted again when a climate file changes (e.g. a new decade file) and takes about 4 bytes per
+# cropland grid cell and day (a few GB per variable for the full record).
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .cache import CACHE_DIR, fingerprint
+from .data import climate_files, open_climate
+from .reader import latitude_bands, read_cells, year_slice
+
+
+def cell_cache_paths(repo_path, variable):
+    # Data (.npy) and index (.nc) file of the cache of a climate variable
+    folder = repo_path / CACHE_DIR
+    return folder / f"climate_{variable}.npy", folder / f"climate_{variable}.nc"
+
+
+class CellCache:
+    # Memory-mapped cache of a climate variable, used in place of the list of decade datasets by run.compute_indicators
+    # and parallel.band_stat. It holds the path and the index, not the data, so it is cheap to send to worker processes.
+
+    def __init__(self, path, index):
+        self.path = path
+        self.lats = index["lat"].values
+        self.lons = index["lon"].values
+        self.time_stamps = index["time"].values
+        self.cells = pd.MultiIndex.from_arrays([self.lats, self.lons])
+        self.files = [str(path)]
+
+    def covers(self, lats, lons):
+        # Whether all grid cells are in the cache
+        return bool((self.cells.get_indexer(pd.MultiIndex.from_arrays([np.asarray(lats), np.asarray(lons)])) >= 0).all())
+
+    def time(self, years=None):
+        # Time stamps of the cache (only the given years, see reader.year_slice)
+        return self.time_stamps[year_slice(self.time_stamps, years)]
+
+    def bands(self, lats, tile_rows):
+        # Indices of the grid cells in every band of tile_rows latitude rows (of the rows with cropland grid cells)
+        rows = np.searchsorted(np.unique(self.lats), np.asarray(lats))
+        band = rows // tile_rows
+        return [np.flatnonzero(band == b) for b in np.unique(band)]
+
+    def read(self, lats, lons, years=None):
+        # Numpy array (time, cell) with the daily series of the grid cells (see reader.read_cells)
+        rows = self.cells.get_indexer(pd.MultiIndex.from_arrays([np.asarray(lats), np.asarray(lons)]))
+        if (rows < 0).any():
+            raise KeyError("Grid cell(s) not in the climate cache")
+        data = np.load(self.path, mmap_mode="r")
+        # The rows are sorted by latitude, so the grid cells of a band are one contiguous block
+        row0 = rows.min()
+        block = np.asarray(data[row0:rows.max() + 1, year_slice(self.time_stamps, years)])
+        return np.ascontiguousarray(block[rows - row0].T)
+
+
+def build_cell_cache(repo_path, variable, lats, lons, tile_rows=5):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - variable: climate variable ("tasmax" or "pr")
+    # - lats, lons: coordinates of the grid cells to cache
+    # - tile_rows: number of latitude rows of the climate grid read at once
+    # OUTPUT:
+    # - CellCache of the grid cells (written to the files of cell_cache_paths)
+
+    data_path, index_path = cell_cache_paths(repo_path, variable)
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    if index_path.exists():
+        index_path.unlink()
+
+    cells = pd.DataFrame({"lat": np.asarray(lats, dtype=float), "lon": np.asarray(lons, dtype=float)})
+    cells = cells.drop_duplicates().sort_values(["lat", "lon"]).reset_index(drop=True)
+    decades = open_climate(repo_path, variable)
+    time = np.concatenate([decade["time"].values for decade in decades])
+    dtype = decades[0][variable].dtype
+
+    data = np.lib.format.open_memmap(data_path, mode="w+", dtype=dtype, shape=(len(cells), len(time)))
+    for band in latitude_bands(decades, cells["lat"].values, tile_rows):
+        data[band] = read_cells(decades, variable, cells["lat"].values[band], cells["lon"].values[band]).T
+    data.flush()
+    del data
+    for decade in decades:
+        decade.close()
+
+    index = xr.Dataset(coords={"lat": ("cell", cells["lat"].values), "lon": ("cell", cells["lon"].values), "time": time},
+                       attrs={"inputs": fingerprint(repo_path, climate_files(repo_path, variable))})
+    index.to_netcdf(index_path)
+    return CellCache(data_path, index)
+
+
+def open_cell_cache(repo_path, variable):
+    # CellCache of a climate variable if it was converted from the current climate files, otherwise None
+    data_path, index_path = cell_cache_paths(repo_path, variable)
+    if not data_path.exists() or not index_path.exists():
+        return None
+    index = xr.load_dataset(index_path)
+    if index.attrs.get("inputs") != fingerprint(repo_path, climate_files(repo_path, variable)):
+        return None
+    return CellCache(data_path, index)
+
+
+def load_cell_cache(repo_path, variable, lats, lons, tile_rows=5):
+    # CellCache of a climate variable that covers the grid cells, converted first if needed (see build_cell_cache)
+    cache = open_cell_cache(repo_path, variable)
+    if cache is None or not cache.covers(lats, lons):
+        cache = build_cell_cache(repo_path, variable, lats, lons, tile_rows)
+    return cache
@@ -0,0 +1,73 @@
+## CHECKPOINTS OF THE LATITUDE BANDS
+
+# A run over the global grid can be stopped before the end (e.g. by the wall-clock limit of an HPC queue). To not
+# lose the work done, every completed latitude band of compute_indicators can be saved to a checkpoint folder, and a
+# resumed run loads the saved bands instead of computing them again. A band file stores a fingerprint of its inputs
+# (climate files, grid cells, growing seasons and their day masks, years and percentiles), so a band is only reused for the same
+# computation and computed again otherwise. The known thresholds are left out of the fingerprint: they are the
+# percentiles of the same data (from the threshold cache, which a resumed run may have filled in the meantime), and so
+# is the backend, which gives the same indicators.
+# The folder is emptied by the caller once the outputs are written.
+
+import hashlib
+import os
+
+import numpy as np
+import xarray as xr
+
+from .cache import CACHE_DIR
+from .timeindex import time_index
+
+CHECKPOINT_DIR = f"{CACHE_DIR}/checkpoints"
+
+
+def band_key(task):
+    # Fingerprint of a band_stat task (see parallel.band_stat): hexadecimal string that changes with any of its inputs
+    sources, variable, lats, lons, time, start_day, end_day, family, percentiles, cell_index, thresholds, years, _, day_mask = task
+    digest = hashlib.sha1()
+    for source in sources:
+        if isinstance(source, str):
+            stat = os.stat(source)
+            digest.update(f"{source}|{stat.st_size}|{stat.st_mtime_ns};".encode())
+    stamps = time_index(time).time
+    digest.update(f"{variable}|{family}|{sorted((percentiles or {}).items())}|{years}|{stamps[0]}|{stamps[-1]}|{len(stamps)};".encode())
+    for array in (lats, lons, start_day, end_day, cell_index):
+        digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    if day_mask is not None:
+        digest.update(np.packbits(day_mask).tobytes())
+    return digest.hexdigest()
+
+
+def band_path(folder, family, number):
+    # Checkpoint file of a latitude band of a family
+    return folder / f"{family}_band{number:04d}.nc"
+
+
+def load_band(path, key):
+    # Saved band_stat result (years, stats, thresholds) if the file exists and has the same fingerprint, otherwise None
+    if not path.exists():
+        return None
+    band = xr.load_dataset(path)
+    if band.attrs.get("inputs") != key:
+        return None
+    stats = {name: band[name].values for name in band.data_vars if name != "thresholds"}
+    return band["year"].values, stats, band["thresholds"].values
+
+
+def save_band(path, key, years, stats, thresholds):
+    # Save a band_stat result. It is written to a temporary file first, so a run stopped while writing does not
+    # leave a broken checkpoint behind.
+    # the indicators of a sweep have a leading threshold dimension (see engine.indicator_spec)
+    band = xr.Dataset({name: (("threshold", "year", "season")[-np.ndim(stat):], stat) for name, stat in stats.items()},
+                      coords={"year": years}, attrs={"inputs": key})
+    band["thresholds"] = (("extreme", "season"), thresholds)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    band.to_netcdf(temporary)
+    os.replace(temporary, path)
+
+
+def clear_checkpoints(folder):
+    # Delete the band files of a checkpoint folder
+    for path in list(folder.glob("*_band*.nc")) + list(folder.glob("*_band*.tmp")):
+        path.unlink()
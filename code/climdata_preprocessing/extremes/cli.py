@@ -0,0 +1,144 @@
+## COMMAND-LINE RUNNER
+
+# Single entry point to compute the indicators without editing the scripts: crops, indicator families, years, a
+# region (lat/lon bounding box and/or countries of the ISIMIP country mask) and the output location are options.
+# Run from code/climdata_preprocessing, e.g.
+#   python -m extremes --repo-path /data --crops mai soy --families hot
+#   python -m extremes --repo-path /data --bbox 45 55 0 10 --years 2001 2010 --output-dir /tmp/test
+# Without options, all families are computed for all crops and the crop aggregate (as indicators_all.py).
+
+import argparse
+from pathlib import Path
+
+import xarray as xr
+
+from .checkpoint import CHECKPOINT_DIR, clear_checkpoints
+from .data import CROP_NAMES
+from .engine import INDICATORS
+from .kernel import BACKENDS
+from .profiling import Profile
+from .region import make_region
+
+
+def _percentile(text):
+    # NAME=Q option value, e.g. FHD=0.95, or NAME=Q,Q,... for a sweep over several thresholds, e.g. FHD=0.9,0.95,0.99
+    name, _, q = text.partition("=")
+    try:
+        levels = [float(level) for level in q.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected NAME=Q or NAME=Q,Q,... (e.g. FHD=0.95), got {text!r}")
+    return name, levels if "," in q else levels[0]
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog="python -m extremes", description="Compute the climate extreme indicators.")
+    parser.add_argument("--repo-path", type=Path, default=Path(""), help="base path of the repository")
+    parser.add_argument("--crops", nargs="+", choices=(*CROP_NAMES, "aggr"), default=(*CROP_NAMES, "aggr"),
+                        help="crops and/or aggr for the crop aggregate (default: all)")
+    parser.add_argument("--families", nargs="+", choices=tuple(INDICATORS), default=tuple(INDICATORS),
+                        help="indicator families (default: all)")
+    parser.add_argument("--years", nargs=2, type=int, metavar=("FIRST", "LAST"),
+                        help="years of the climate data to use (the thresholds are percentiles of these years)")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"),
+                        help="only the grid cells within this bounding box")
+    parser.add_argument("--countries", nargs="+", metavar="ISO",
+                        help="only the grid cells of these countries of the ISIMIP country mask (ISO codes)")
+    parser.add_argument("--aggr-union", action="store_true",
+                        help="crop aggregate over the exact union of the crops' seasons instead of their earliest start to latest end")
+    parser.add_argument("--percentile", nargs="+", type=_percentile, default=[], metavar="NAME=Q",
+                        help="percentile of a frequency indicator (e.g. FHD=0.95), or several for a sweep with a threshold "
+                             "dimension (e.g. FHD=0.9,0.95,0.975,0.99, with --output files)")
+    parser.add_argument("--output", choices=("files", "store", "both"), default="both",
+                        help="one netcdf file per indicator and crop, one store with all of them, or both")
+    parser.add_argument("--output-dir", type=Path,
+                        help="output folder (default: GGCMI-validation/data/processed/extremes_indicators, "
+                             "required with --years, --bbox or --countries)")
+    parser.add_argument("--tile-rows", type=int, default=5, help="latitude rows of the climate grid processed at once")
+    parser.add_argument("--workers", type=int, default=1, help="processes that compute latitude bands in parallel")
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy",
+                        help="numpy (vectorized) or numba (compiled one-pass kernel, numpy is used if numba is not installed)")
+    parser.add_argument("--lazy", action="store_true", help="dask mode (writes the files to the default folder)")
+    parser.add_argument("--update", action="store_true",
+                        help="only compute the years of new climate data and add them to the store")
+    parser.add_argument("--no-cache", action="store_true", help="recompute the growing seasons and thresholds")
+    parser.add_argument("--cell-cache", action="store_true",
+                        help="read the climate data from the cell-major cache (converted from the netcdf files on first use)")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="save every completed latitude band, to resume the run with --resume if it is stopped")
+    parser.add_argument("--resume", action="store_true",
+                        help="reuse the latitude bands saved by a stopped run with the same inputs (implies --checkpoint)")
+    parser.add_argument("--checkpoint-dir", type=Path,
+                        help="folder of the saved latitude bands (default: extremes_indicators/cache/checkpoints)")
+    parser.add_argument("--no-profile", action="store_true", help="do not print the progress and the stage times")
+    parser.add_argument("--profile-json", type=Path, help="save the stage times, cells per second and peak memory as json")
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    selection = args.years or args.bbox or args.countries
+    subset = selection or args.output_dir
+    if selection and not args.output_dir and not args.update:
+        # the outputs of a subset must not replace the full record and domain in the default folder (and store)
+        parser().error("--years, --bbox and --countries need --output-dir")
+    if (args.lazy or args.update) and (args.checkpoint or args.resume or args.cell_cache):
+        parser().error("--checkpoint, --resume and --cell-cache are not available with --lazy and --update")
+    if (args.lazy or args.update) and args.aggr_union:
+        parser().error("--aggr-union is not available with --lazy and --update (which keeps the season of the store)")
+    if args.lazy and subset:
+        parser().error("--lazy runs on the full record and domain, without --years, --bbox, --countries or --output-dir")
+    sweep = any(isinstance(q, list) for _, q in args.percentile)
+    if sweep and (args.lazy or args.output != "files"):
+        parser().error("a percentile sweep (NAME=Q,Q,...) is saved as files only: use --output files, without --lazy")
+    if args.update and (subset or args.percentile):
+        parser().error("--update extends the store with its own thresholds, without selection or percentile options")
+
+    from .run import run_all, save_indicator_store, save_indicators, update_store
+
+    profile = Profile(enabled=not args.no_profile)
+    if args.update:
+        from .data import store_path
+        from .store import load_store
+        years = update_store(args.repo_path, tile_rows=args.tile_rows, workers=args.workers, profile=profile,
+                             backend=args.backend)
+        print(f"Computed the years {years}" if years else "No new years in the climate data")
+        if years and args.output in ("files", "both"):
+            with xr.open_dataset(store_path(args.repo_path)) as store:
+                crops = [str(crop) for crop in store["crop"].values if crop in args.crops]
+            with profile.stage("write"):
+                for crop in crops:
+                    save_indicators(load_store(store_path(args.repo_path), crop), args.repo_path, crop)
+        _finish(profile, args.profile_json)
+        return
+
+    percentiles = dict(args.percentile) or None
+    if args.lazy:
+        from .lazy import run_lazy
+        run_lazy(args.repo_path, args.families, args.crops, percentiles, args.tile_rows, not args.no_cache, args.backend)
+        return
+
+    region = make_region(args.repo_path, args.bbox, args.countries)
+    checkpoint = None
+    if args.checkpoint or args.resume:
+        checkpoint = args.checkpoint_dir or args.repo_path / CHECKPOINT_DIR
+    thresholds = {}
+    indicators = run_all(args.repo_path, args.families, args.crops, percentiles, args.tile_rows, args.workers,
+                         not args.no_cache, "cells", thresholds, tuple(args.years) if args.years else None, region, profile,
+                         checkpoint, args.resume, args.cell_cache, args.backend, args.aggr_union)
+    with profile.stage("write"):
+        if args.output in ("files", "both"):
+            for crop, crop_indicators in indicators.items():
+                save_indicators(crop_indicators, args.repo_path, crop, args.output_dir)
+        if args.output in ("store", "both"):
+            save_indicator_store(indicators, args.repo_path, thresholds, percentiles, region, args.output_dir, args.aggr_union)
+    # The run is complete, the saved bands are no longer needed
+    if checkpoint is not None:
+        clear_checkpoints(checkpoint)
+    _finish(profile, args.profile_json)
+
+
+def _finish(profile, path):
+    # Print the stage times and save them if asked
+    profile.report()
+    if path:
+        profile.dump(path)
@@ -0,0 +1,148 @@
+## LOADING OF THE CLIMATE, CROP AND CROP CALENDAR DATA
+
+# All paths are relative to the folder that contains the GGCMI-validation repository (repo_path in the scripts).
+
+import pandas as pd
+import pyreadr
+import xarray as xr
+
+from .cache import cache_path, fingerprint, load_cached, save_cached
+
+# Main crops (see README.md for the abbreviations), in the order in which their seasons are merged
+CROP_NAMES = ["mai", "ri1", "ri2", "soy", "swh", "wwh"]
+
+# Columns of the dat_<crop> tables of CROPDATA_FILE used for the growing seasons, and their dtypes. The areas are only
+# compared with 0, so float32 keeps the results identical.
+CROPDAT_DTYPES = {"lat": "float64", "lon": "float64", "rain_area": "float32", "irr_area": "float32"}
+
+# Decade files of the GSWP3-W5E5 daily climate data
+DECADES = ["1981_1990", "1991_2000", "2001_2010", "2011_2019"]
+
+CLIMDATA_DIR = "GGCMI-validation/data/raw/climdata"
+CROPDATA_FILE = "GGCMI-validation/data/processed/crop_specific_data.RData"
+CALENDAR_DIR = "GGCMI-validation/data/raw/other"
+OUTPUT_DIR = "GGCMI-validation/data/processed/extremes_indicators"
+
+# Crop data tables of the current run (see load_cropdata), by fingerprint of CROPDATA_FILE
+_cropdata = {}
+
+
+def climate_files(repo_path, variable):
+    # Paths of the decade files of a climate variable ("tasmax" or "pr"), in time order. Besides the DECADES, any other
+    # decade file in the folder is included (e.g. from a new GSWP3-W5E5 release extended past 2019).
+    folder = repo_path / CLIMDATA_DIR
+    files = {folder / f"gswp3-w5e5_obsclim_{variable}_global_daily_{decade}.nc" for decade in DECADES}
+    files.update(folder.glob(f"gswp3-w5e5_obsclim_{variable}_global_daily_*.nc"))
+    # the decade in the file name (e.g. 1981_1990) sorts in time order
+    return sorted(files)
+
+
+def open_climate(repo_path, variable):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - variable: climate variable ("tasmax" or "pr")
+    # OUTPUT:
+    # - list with the (lazily opened) xarray dataset of every decade, in time order.
+    #   The data is only read band by band (see reader.py).
+
+    return [xr.open_dataset(path, engine="netcdf4") for path in climate_files(repo_path, variable)]
+
+
+def load_cropdata(repo_path):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # OUTPUT:
+    # - dictionary {crop: dataframe with the lat, lon, rain_area and irr_area of the locations where the crop is grown}
+    #   for all CROP_NAMES (earlier processed in R as RData)
+
+    # The RData file is parsed once for all crops, and only once per run: the tables (only the columns used here, with
+    # compact dtypes) are kept in memory and saved in the cache folder for later runs
+    path = repo_path / CROPDATA_FILE
+    key = fingerprint(repo_path, [path])
+    if key not in _cropdata:
+        table = load_cached(cache_path(repo_path, "cropdata_table"), key)
+        if table is None:
+            tables = pyreadr.read_r(path, use_objects=[f"dat_{crop}" for crop in CROP_NAMES])
+            rows = pd.concat([tables[f"dat_{crop}"][list(CROPDAT_DTYPES)].assign(crop=crop) for crop in CROP_NAMES], ignore_index=True)
+            table = xr.Dataset({column: ("row", rows[column].values.astype(dtype)) for column, dtype in CROPDAT_DTYPES.items()},
+                               coords={"crop": ("row", rows["crop"].values.astype(str))})
+            save_cached(table, cache_path(repo_path, "cropdata_table"), key)
+        crops = table["crop"].values
+        _cropdata.clear()
+        _cropdata[key] = {crop: pd.DataFrame({column: table[column].values[crops == crop] for column in CROPDAT_DTYPES})
+                          for crop in CROP_NAMES}
+    return _cropdata[key]
+
+
+def load_cropdat(repo_path, crop):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - crop: crop name
+    # OUTPUT:
+    # - dataframe with the locations where the crop is grown (see load_cropdata), one row per grid cell
+
+    cropdat = load_cropdata(repo_path)[crop]
+    return cropdat.drop_duplicates(subset=["lon", "lat"])
+
+
+def load_cropdat_aggr(repo_path, crop_names=CROP_NAMES):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - crop_names: crops to combine
+    # OUTPUT:
+    # - dataframe with one row per grid cell and rain_area_<crop> and irr_area_<crop> columns for every crop
+    #   (0 when the crop is not present in that grid cell)
+
+    return combine_cropdat({crop: load_cropdat(repo_path, crop) for crop in crop_names})
+
+
+def combine_cropdat(cropdat_dict):
+    # INPUT:
+    # - cropdat_dict: dictionary {crop: dataframe as returned by load_cropdat}
+    # OUTPUT:
+    # - dataframe with one row per grid cell and rain_area_<crop> and irr_area_<crop> columns for every crop
+    #   (see load_cropdat_aggr)
+
+    cropdat_all = pd.concat([cropdat.assign(crop=crop) for crop, cropdat in cropdat_dict.items()])
+
+    # Pivot the data to get one row per lat-lon, and separate columns for each crop's rain and irr areas
+    reshaped_data = cropdat_all.pivot_table(
+        index=["lat", "lon"],
+        columns="crop",
+        values=["rain_area", "irr_area"],
+        fill_value=0
+    )
+
+    # The pivot_table results in multi-level columns (e.g., ('rain_area', 'swh')), so we flatten them
+    reshaped_data.columns = ["_".join(col).strip() for col in reshaped_data.columns.values]
+    reshaped_data.reset_index(inplace=True)
+    return reshaped_data.drop_duplicates(subset=["lon", "lat"])
+
+
+def calendar_file(repo_path, crop, irrigation):
+    # Path of the ISIMIP crop calendar of a crop for "firr" (full irrigation) or "noirr" (rainfed)
+    return repo_path / CALENDAR_DIR / f"ggcmi-crop-calendar-phase3_2015soc_{crop}_{irrigation}.nc"
+
+
+def load_calendar(repo_path, crop, irrigation):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - crop: crop name
+    # - irrigation: "firr" (full irrigation) or "noirr" (rainfed)
+    # OUTPUT:
+    # - ISIMIP crop calendar xarray dataset with planting_day and maturity_day
+
+    return xr.open_dataset(calendar_file(repo_path, crop, irrigation))
+
+
+def output_path(repo_path, name, crop, output_dir=None, sweep=False):
+    # Netcdf file of an indicator: crop_aggregated/<name>_aggr.nc or crop_specific/<name>_<crop>.nc
+    # in OUTPUT_DIR (or in output_dir if given). The indicators of a percentile sweep (with a threshold dimension) are
+    # saved as <name>_<crop>_sweep.nc, next to the (year, lat, lon) files read by the analysis.
+    folder = "crop_aggregated" if crop == "aggr" else "crop_specific"
+    return (output_dir or repo_path / OUTPUT_DIR) / folder / f"{name}_{crop}{'_sweep' if sweep else ''}.nc"
+
+
+def store_path(repo_path, output_dir=None):
+    # Netcdf4 file with all indicators of all crops (see store.py) in OUTPUT_DIR (or in output_dir if given)
+    return (output_dir or repo_path / OUTPUT_DIR) / "extremes_indicators.nc"
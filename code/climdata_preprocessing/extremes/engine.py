@@ -0,0 +1,295 @@
+## BATCHED GROWING SEASON STATISTICS
+
+# Computes the climate extreme indicators for all grid cells at once. Instead of selecting one grid cell and one
+# year at a time, the daily series of all grid cells are stacked in a (time, cell) array and the growing season of
+# every cell is expressed as a (time, cell) mask built from its planting and maturity day.
+
+# The counting rules are the ones of the original per-cell season_stat loop:
+# - a season with planting day <= maturity day is counted per calendar year
+# - a season with maturity day < planting day spans two calendar years and is labelled with the year in which it ends.
+#   The last year of the record is set to 0 (hard-coded as year == 2019 in the original scripts)
+# - seasons that are not fully covered by the record (e.g. the season ending in the first year of the record that
+#   started before it, or a record ending within a season) are set to 0. This is derived from the time stamps, so it
+#   holds for any record length.
+# - the threshold is a percentile of all growing season days of the full record (linear interpolation, NaN skipped,
+#   computed for all grid cells at once in percentile.py)
+# - frequencies are divided by the nominal season length (end - start + 1, or 365 - start + 1 + end across years)
+# A growing season can also be given as a day-of-year mask (e.g. the exact union of the seasons of all crops, see
+# seasons.union_season): the mask then selects the growing season days, the planting and maturity day only set the
+# season year of the days, and the nominal season length is the number of days in the mask (of a 365-day year).
+
+import numpy as np
+
+from .percentile import nan_quantiles
+from .runlength import longest_run
+from .timeindex import days_in_year, time_index
+
+# Indicator families: the climate variable and the extremes derived from it.
+# Every extreme is given as (frequency indicator, spell indicator, percentile, side of the threshold).
+# "total" is the indicator with the growing season sum of the variable (None if not computed).
+INDICATORS = {
+    "hot": {
+        "variable": "tasmax",
+        "extremes": [("FHD", "LHS", 0.95, "above")],
+        "total": None,
+    },
+    "drywet": {
+        "variable": "pr",
+        "extremes": [("FDD", "LDS", 0.05, "below"), ("FWD", "LWS", 0.95, "above")],
+        "total": "TPR",
+    },
+}
+
+
+def indicator_spec(family, percentiles=None):
+    # INPUT:
+    # - family: key of INDICATORS ("hot" or "drywet")
+    # - percentiles: optional dictionary {frequency indicator: percentile} to replace the default thresholds,
+    #   e.g. {"FHD": 0.9}. A list of percentiles sweeps over several thresholds, e.g. {"FHD": [0.9, 0.95, 0.99]}.
+    # OUTPUT:
+    # - indicator specification as in INDICATORS. The extreme of a sweep is repeated for every percentile (so all
+    #   thresholds are computed and evaluated in the same pass over the data) and "sweep" holds the percentiles
+    #   {frequency indicator: list} of every sweep.
+
+    spec = INDICATORS[family]
+    if not percentiles:
+        return spec
+    unknown = set(percentiles) - {frequency for frequency, _, _, _ in spec["extremes"]}
+    if unknown:
+        raise ValueError(f"No {family} indicator(s) {sorted(unknown)}")
+    extremes, sweep = [], {}
+    for frequency, spell, q, side in spec["extremes"]:
+        q = percentiles.get(frequency, q)
+        if np.ndim(q) == 0:
+            extremes.append((frequency, spell, q, side))
+            continue
+        if len(q) == 0 or len(set(q)) < len(q):
+            raise ValueError(f"The percentiles of {frequency} must be a non-empty list without duplicates, got {q}")
+        sweep[frequency] = [float(level) for level in q]
+        extremes += [(frequency, spell, level, side) for level in sweep[frequency]]
+    return dict(spec, extremes=extremes, sweep=sweep)
+
+
+def family_percentiles(family, percentiles):
+    # Percentiles {frequency indicator: percentile} of the indicators of a family, from a dictionary with the ones of
+    # any family (None if there are none)
+    if not percentiles:
+        return None
+    unknown = set(percentiles) - {extreme[0] for spec in INDICATORS.values() for extreme in spec["extremes"]}
+    if unknown:
+        raise ValueError(f"No indicator(s) {sorted(unknown)}")
+    frequencies = {extreme[0] for extreme in INDICATORS[family]["extremes"]}
+    return {frequency: q for frequency, q in percentiles.items() if frequency in frequencies} or None
+
+
+def sweep_levels(spec):
+    # Percentiles of the threshold dimension {indicator: list} of the frequency and spell indicators of every sweep
+    sweep = spec.get("sweep", {})
+    return {name: sweep[frequency] for frequency, spell, _, _ in spec["extremes"] if frequency in sweep
+            for name in (frequency, spell)}
+
+
+def season_mask(dayofyear, start_day, end_day, day_mask=None):
+    # INPUT:
+    # - dayofyear: numpy array (time) with the day of year of every day
+    # - start_day, end_day: numpy arrays (cell) with the planting and maturity day of every grid cell
+    # - day_mask: optional boolean numpy array (cell, 366) with the growing season days of year of every grid cell,
+    #   used instead of the days from planting to maturity (see season_days)
+    # OUTPUT:
+    # - boolean numpy array (time, cell), True for the growing season days of every grid cell
+
+    if day_mask is not None:
+        return day_mask.T[np.asarray(dayofyear) - 1]
+    doy = np.asarray(dayofyear)[:, None]
+    within = (doy >= start_day) & (doy <= end_day)   # seasons within one calendar year
+    across = (doy >= start_day) | (doy <= end_day)   # seasons spanning two calendar years
+    # comparisons with NaN are False, so cells without a season are never in season
+    return np.where(end_day < start_day, across, within)
+
+
+def season_days(start_day, end_day):
+    # Boolean numpy array (cell, 366), True for the days of year from planting to maturity of every grid cell
+    return season_mask(np.arange(1, 367), start_day, end_day).T
+
+
+def season_length(start_day, end_day, day_mask=None):
+    # Nominal number of growing season days (+1 to include both the start and end day), or the number of days of
+    # day_mask (see season_mask) in a 365-day year
+    if day_mask is not None:
+        return day_mask[:, :365].sum(axis=1)
+    return np.where(end_day < start_day, (365 - start_day + 1) + end_day, end_day - start_day + 1)
+
+
+def expected_days(years, start_day, end_day, day_mask=None):
+    # INPUT:
+    # - years: numpy array (year) of season years
+    # - start_day, end_day: numpy arrays (cell) with the planting and maturity day of every grid cell
+    # - day_mask: optional growing season days of year of every grid cell (see season_mask)
+    # OUTPUT:
+    # - numpy array (year, cell) with the number of calendar days of the season that ends in every year
+    #   (the days after planting in the previous year are included for seasons spanning two calendar years)
+
+    years = np.asarray(years)[:, None]
+    days_in_current = days_in_year(years)
+    days_in_previous = days_in_year(years - 1)
+    if day_mask is not None:
+        # Days of the mask in the season year, and after planting in the previous year for seasons spanning two calendar
+        # years. The 366th day only counts in leap years.
+        after = (end_day < start_day)[:, None] & (np.arange(1, 367) >= np.asarray(start_day)[:, None])
+        current, previous = day_mask & ~after, day_mask & after
+        return (current[:, :365].sum(axis=1) + current[:, 365] * (days_in_current == 366)
+                + previous[:, :365].sum(axis=1) + previous[:, 365] * (days_in_previous == 366))
+    within = np.clip(np.minimum(end_day, days_in_current) - start_day + 1, 0, None)
+    across = np.minimum(end_day, days_in_current) + np.clip(days_in_previous - start_day + 1, 0, None)
+    return np.where(end_day < start_day, across, within)
+
+
+def exceeds(values, threshold, side):
+    # Binary extreme days: at or above the threshold for "above", at or below for "below" (NaN is never extreme)
+    if side == "above":
+        return values >= threshold
+    return values <= threshold
+
+
+def season_thresholds(values, time, start_day, end_day, family, percentiles=None, cell_index=None, thresholds=None,
+                      day_mask=None):
+    # INPUT:
+    # - values, time, start_day, end_day, family, percentiles, cell_index, day_mask: as in season_stat
+    # - thresholds: optional numpy array (extreme, season) with already known thresholds (e.g. from the cache),
+    #   NaN where a threshold still has to be computed
+    # OUTPUT:
+    # - numpy array (extreme, season) with the threshold of every extreme of the family (in the order of "extremes"),
+    #   a percentile of all growing season days of the full record. NaN for seasons without any growing season day.
+
+    extremes = indicator_spec(family, percentiles)["extremes"]
+    start_day = np.asarray(start_day, dtype=float)
+    end_day = np.asarray(end_day, dtype=float)
+    if cell_index is None:
+        cell_index = np.arange(len(start_day))
+    if thresholds is None:
+        thresholds = np.full((len(extremes), len(start_day)), np.nan)
+    thresholds = np.array(thresholds, dtype=float)
+
+    # Only the seasons with a missing threshold are computed
+    missing = np.flatnonzero(np.isnan(thresholds).any(axis=0) & (~np.isnan(start_day) & ~np.isnan(end_day)))
+    if len(missing):
+        dayofyear = time_index(time).dayofyear
+        in_season = season_mask(dayofyear, start_day[missing], end_day[missing], None if day_mask is None else day_mask[missing])
+        # float64 as xarray's .quantile of the original scripts (a float32 threshold changes the days lying on it)
+        growing = np.where(in_season, values[:, cell_index[missing]].astype(np.float64), np.nan)
+        # All percentiles of the family from one ordering of the growing season days (see percentile.py)
+        computed = nan_quantiles(growing, [q for _, _, q, _ in extremes])
+        thresholds[:, missing] = np.where(np.isnan(thresholds[:, missing]), computed, thresholds[:, missing])
+    return thresholds
+
+
+def season_stat(values, time, start_day, end_day, family, percentiles=None, cell_index=None, thresholds=None,
+                keep_last_wrap=False, day_mask=None):
+    # INPUT:
+    # - values: numpy array (time, cell) with the daily climate variable of every grid cell
+    # - time: time stamps of the first axis of values (daily, sorted), or their timeindex.TimeIndex
+    # - start_day, end_day: numpy arrays (cell) with the planting and maturity day of every grid cell (NaN if no season)
+    # - family: key of INDICATORS ("hot" or "drywet")
+    # - percentiles: optional dictionary {frequency indicator: percentile} (see indicator_spec)
+    # - cell_index: optional numpy array with the column of values for every season in start_day/end_day. This lets
+    #   several growing seasons (e.g. every crop and the crop aggregate) share one daily series per grid cell.
+    # - thresholds: optional numpy array (extreme, season) with precomputed thresholds (see season_thresholds)
+    # - keep_last_wrap: keep the seasons spanning two calendar years that end in the last year of the record. They are
+    #   complete if the record ends on 31 December, but the original scripts set them to 0.
+    # - day_mask: optional boolean numpy array (season, 366) with the growing season days of year of every season
+    #   (see season_mask). start_day and end_day then only set the season year of the days.
+    # OUTPUT:
+    # - years: calendar years of the record
+    # - stats: dictionary with a numpy array (year, season) for every indicator of the family, (threshold, year, season)
+    #   for the indicators of a sweep (in the order of its percentiles, see indicator_spec)
+
+    spec = indicator_spec(family, percentiles)
+    extremes = spec["extremes"]
+    start_day = np.asarray(start_day, dtype=float)
+    end_day = np.asarray(end_day, dtype=float)
+
+    time = time_index(time)
+    dayofyear = time.dayofyear
+    unique_years = time.years
+    n_years, n_cells = len(unique_years), len(start_day)
+
+    # Thresholds across all growing season days of the record
+    thresholds = season_thresholds(values, time, start_day, end_day, family, percentiles, cell_index, thresholds, day_mask)
+    if cell_index is None:
+        cell_index = slice(None)
+
+    # One extra season year for the seasons that start in the last year of the record
+    counts = np.zeros((len(extremes), n_years + 1, n_cells))
+    longest = np.zeros((len(extremes), n_years + 1, n_cells), dtype=int)
+    total = np.zeros((n_years + 1, n_cells))
+    # number of growing season days in the record, to find the seasons it covers completely
+    observed = np.zeros((n_years + 1, n_cells), dtype=int)
+    # ongoing spell at the end of the previous calendar year, for seasons spanning two calendar years
+    carry = np.zeros((len(extremes), n_cells), dtype=np.int32)
+
+    # Go through the record one calendar year at a time. Every day of year i belongs to season year i, or to
+    # season year i + 1 for the days after planting of seasons spanning two calendar years.
+    for i, (year, days) in enumerate(zip(unique_years, time.year_slices)):
+        block = values[days][:, cell_index]
+        in_season = season_mask(dayofyear[days], start_day, end_day, day_mask)
+        next_season = in_season & time.next_year(start_day, end_day, days)
+        this_season = in_season & ~next_season
+        observed[i] += this_season.sum(axis=0)
+        observed[i + 1] += next_season.sum(axis=0)
+
+        for k, (threshold, (_, _, _, side)) in enumerate(zip(thresholds, extremes)):
+            binary = exceeds(block, threshold, side)
+            counts[k, i] += (binary & this_season).sum(axis=0)
+            counts[k, i + 1] += (binary & next_season).sum(axis=0)
+
+            # Longest spells: the part of a season in this calendar year continues the spell carried over
+            # from the end of the previous calendar year
+            this_longest, _ = longest_run(binary & this_season, carry=carry[k])
+            next_longest, carry[k] = longest_run(binary & next_season)
+            longest[k, i] = np.maximum(longest[k, i], this_longest)
+            longest[k, i + 1] = np.maximum(longest[k, i + 1], next_longest)
+
+        if spec["total"] is not None:
+            total[i] += np.nansum(np.where(this_season, block, 0), axis=0, dtype=float)
+            total[i + 1] += np.nansum(np.where(next_season, block, 0), axis=0, dtype=float)
+
+    return unique_years, season_indicators(spec, unique_years, start_day, end_day, counts, longest, total, observed,
+                                           keep_last_wrap, day_mask)
+
+
+def season_indicators(spec, years, start_day, end_day, counts, longest, total, observed, keep_last_wrap=False,
+                      day_mask=None):
+    # INPUT:
+    # - spec: indicator specification of the family (see indicator_spec)
+    # - years: calendar years of the record
+    # - start_day, end_day: numpy arrays (season) with the planting and maturity day of every grid cell
+    # - counts, longest: numpy arrays (extreme, season year, season) with the number of extreme days and the longest
+    #   spell of every season year (one more season year than years, for the seasons that start in the last year)
+    # - total: numpy array (season year, season) with the growing season sum of the variable
+    # - observed: numpy array (season year, season) with the number of growing season days in the record
+    # - keep_last_wrap, day_mask: see season_stat
+    # OUTPUT:
+    # - dictionary with a numpy array (year, season) for every indicator of the family (see season_stat), or
+    #   (threshold, year, season) for the indicators of a sweep (see indicator_spec)
+
+    n_years = len(years)
+    n_days = season_length(start_day, end_day, day_mask)
+    valid = ~np.isnan(start_day) & ~np.isnan(end_day)
+    stats = {}
+    for k, (frequency, spell, _, _) in enumerate(spec["extremes"]):
+        stats.setdefault(frequency, []).append(np.where(valid, counts[k, :n_years] / np.where(valid, n_days, 1), 0))
+        stats.setdefault(spell, []).append(longest[k, :n_years].astype(float))
+    levels = sweep_levels(spec)
+    stats = {name: np.stack(stat) if name in levels else stat[0] for name, stat in stats.items()}
+    if spec["total"] is not None:
+        stats[spec["total"]] = np.where(valid, total[:n_years], 0)
+
+    # Seasons that are not fully covered by the record (for complete calendar years: the seasons spanning two calendar
+    # years that end in the first year). The seasons spanning two calendar years that end in the last year of the
+    # record are discarded as well (the original scripts hard-code this as year == 2019, the last year of GSWP3-W5E5).
+    incomplete = observed[:n_years] != expected_days(years, start_day, end_day, day_mask)
+    if not keep_last_wrap:
+        incomplete[-1] |= end_day < start_day
+    for name in stats:
+        stats[name][..., incomplete] = 0
+    return stats
@@ -0,0 +1,69 @@
+## GRID CELL EXTRACTION AND REGRIDDING
+
+# Helpers to go from the gridded climate data to a (time, cell) array of the cropland grid cells and
+# from (year, cell) indicator arrays back to the year x lat x lon data arrays that are saved as netcdf.
+
+# The indicators can also be kept in the sparse cell layout: a (year, cell) data array with the lat and lon of every
+# cropland grid cell as coordinates of the cell dimension. Memory and file sizes then grow with the number of cropland
+# grid cells instead of the bounding grid, which is mostly ocean or land without the crop.
+
+import numpy as np
+import xarray as xr
+
+
+def cell_series(data, lats, lons):
+    # INPUT:
+    # - data: xarray data array with dimensions time, lat and lon
+    # - lats, lons: coordinates of the grid cells
+    # OUTPUT:
+    # - numpy array (time, cell) with the daily series of every grid cell
+
+    cells = dict(lat=xr.DataArray(np.asarray(lats), dims="cell"), lon=xr.DataArray(np.asarray(lons), dims="cell"))
+    return data.sel(**cells).transpose("time", "cell").values
+
+
+def to_grid(values, years, lats, lons, thresholds=None):
+    # INPUT:
+    # - values: numpy array (year, cell) with an indicator for every grid cell, or (threshold, year, cell)
+    # - years: years of the year axis of values
+    # - lats, lons: coordinates of the grid cells
+    # - thresholds: percentiles of the threshold axis of values, if any (see engine.indicator_spec)
+    # OUTPUT:
+    # - xarray data array (year, lat, lon) over the unique coordinates of the grid cells, zero where there is no grid cell
+    #   ((threshold, year, lat, lon) with thresholds)
+
+    latitudes = np.unique(lats)
+    longitudes = np.unique(lons)
+    grid = np.zeros((*np.shape(values)[:-1], len(latitudes), len(longitudes)))
+    grid[..., np.searchsorted(latitudes, lats), np.searchsorted(longitudes, lons)] = values
+
+    coords = {"year": years, "lat": latitudes, "lon": longitudes}
+    dims = ["year", "lat", "lon"]
+    if thresholds is not None:
+        coords, dims = {"threshold": thresholds, **coords}, ["threshold", *dims]
+    return xr.DataArray(grid, coords=coords, dims=dims)
+
+
+def to_cells(values, years, lats, lons, thresholds=None):
+    # INPUT:
+    # - values: numpy array (year, cell) with an indicator for every grid cell, or (threshold, year, cell)
+    # - years: years of the year axis of values
+    # - lats, lons: coordinates of the grid cells
+    # - thresholds: percentiles of the threshold axis of values, if any (see engine.indicator_spec)
+    # OUTPUT:
+    # - xarray data array (year, cell) with lat and lon coordinates along the cell dimension ((threshold, year, cell)
+    #   with thresholds)
+
+    coords = {"year": years, "lat": ("cell", np.asarray(lats, dtype=float)), "lon": ("cell", np.asarray(lons, dtype=float))}
+    dims = ["year", "cell"]
+    if thresholds is not None:
+        coords, dims = {"threshold": thresholds, **coords}, ["threshold", *dims]
+    return xr.DataArray(values, coords=coords, dims=dims)
+
+
+def cells_to_grid(indicator):
+    # Sparse (year, cell) or (threshold, year, cell) indicator (see to_cells) as the dense array of to_grid, zero where
+    # there is no grid cell. Grid cells with a missing value (NaN) are set to zero as well.
+    thresholds = indicator["threshold"].values if "threshold" in indicator.dims else None
+    return to_grid(np.nan_to_num(indicator.values), indicator["year"].values, indicator["lat"].values, indicator["lon"].values,
+                   thresholds)
@@ -0,0 +1,127 @@
+## ONE-PASS INDICATOR KERNEL (OPTIONAL NUMBA BACKEND)
+
+# Alternative to the mask-based engine.season_stat: a compiled loop that walks the daily series of every grid cell
+# once and adds each growing season day directly to the counts, spells and totals of its season year, without the
+# temporary (time, cell) masks and binary arrays of the vectorized engine. It is selected with backend="numba"
+# (run.run_all, indicators_all.py or --backend) and needs the numba package; without it the numpy engine is used.
+# The days are the outer loop and the seasons the inner one, with the state of every season (current spell and
+# season year of the previous day) kept in small arrays, so the (time, cell) array of a band is read once in memory
+# order. The thresholds are the same percentiles as the numpy engine (engine.season_thresholds) and the indicators
+# follow the same rules (engine.season_indicators); python -m extremes.reference checks a backend value by value.
+
+import warnings
+
+import numpy as np
+
+from .engine import indicator_spec, season_days, season_indicators, season_stat, season_thresholds
+from .timeindex import time_index
+
+try:
+    import numba
+except ImportError:  # optional, the numpy backend is used without it
+    numba = None
+
+BACKENDS = ("numpy", "numba")
+
+
+def _compile(function):
+    # Compiled with numba if it is installed (plain python otherwise, only used to test the kernel)
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@_compile
+def _season_kernel(values, dayofyear, year_number, columns, start_day, end_day, day_mask, thresholds, above, with_total):
+    # INPUT:
+    # - values: numpy array (time, cell) with the daily climate variable
+    # - dayofyear, year_number: numpy arrays (time) with the day of year and the position of the calendar year of every
+    #   day (see timeindex.TimeIndex)
+    # - columns: numpy array (season) with the column of values of every season
+    # - start_day, end_day: numpy arrays (season) with the planting and maturity day (NaN if no season)
+    # - day_mask: boolean numpy array (season, 366) with the growing season days of year (see engine.season_mask)
+    # - thresholds: numpy array (extreme, season)
+    # - above: boolean numpy array (extreme), True for extremes at or above the threshold, False for at or below
+    # - with_total: whether to sum the variable over the growing season days
+    # OUTPUT:
+    # - counts, longest, total, observed: see engine.season_indicators
+
+    n_times = values.shape[0]
+    n_seasons = columns.shape[0]
+    n_extremes = thresholds.shape[0]
+    n_season_years = year_number[n_times - 1] + 2
+    counts = np.zeros((n_extremes, n_season_years, n_seasons))
+    longest = np.zeros((n_extremes, n_season_years, n_seasons), dtype=np.int64)
+    total = np.zeros((n_season_years, n_seasons))
+    observed = np.zeros((n_season_years, n_seasons), dtype=np.int64)
+    spell = np.zeros((n_extremes, n_seasons), dtype=np.int64)
+    # season year of the previous day, -1 if it was not a growing season day
+    previous = np.full(n_seasons, -1, dtype=np.int64)
+
+    for t in range(n_times):
+        doy = dayofyear[t]
+        for s in range(n_seasons):
+            if not day_mask[s, doy - 1]:
+                previous[s] = -1
+                continue
+
+            # The days after planting of seasons spanning two calendar years belong to the next season year
+            start = start_day[s]
+            season = year_number[t] + 1 if end_day[s] < start and doy >= start else year_number[t]
+            if season != previous[s]:
+                # a spell never continues into another season year
+                for k in range(n_extremes):
+                    spell[k, s] = 0
+            previous[s] = season
+            observed[season, s] += 1
+
+            value = values[t, columns[s]]
+            for k in range(n_extremes):
+                # NaN is never extreme
+                if (value >= thresholds[k, s]) if above[k] else (value <= thresholds[k, s]):
+                    counts[k, season, s] += 1
+                    spell[k, s] += 1
+                    if spell[k, s] > longest[k, season, s]:
+                        longest[k, season, s] = spell[k, s]
+                else:
+                    spell[k, s] = 0
+            if with_total and not np.isnan(value):
+                total[season, s] += value
+
+    return counts, longest, total, observed
+
+
+def kernel_stat(values, time, start_day, end_day, family, percentiles=None, cell_index=None, thresholds=None,
+                keep_last_wrap=False, day_mask=None):
+    # Same arguments and output as engine.season_stat, computed by _season_kernel
+    spec = indicator_spec(family, percentiles)
+    start_day = np.asarray(start_day, dtype=float)
+    end_day = np.asarray(end_day, dtype=float)
+    time = time_index(time)
+
+    thresholds = season_thresholds(values, time, start_day, end_day, family, percentiles, cell_index, thresholds, day_mask)
+    # Growing season days of year of every season, looked up by the kernel (NaN seasons have none)
+    in_days = season_days(start_day, end_day) if day_mask is None else np.asarray(day_mask, dtype=bool)
+    columns = np.arange(len(start_day)) if cell_index is None else np.asarray(cell_index)
+    above = np.array([side == "above" for _, _, _, side in spec["extremes"]])
+    counts, longest, total, observed = _season_kernel(
+        np.asarray(values), time.dayofyear.astype(np.int64), time.year_number.astype(np.int64), columns.astype(np.int64),
+        start_day, end_day, np.ascontiguousarray(in_days), thresholds, above, spec["total"] is not None
+    )
+    return time.years, season_indicators(spec, time.years, start_day, end_day, counts, longest, total, observed,
+                                         keep_last_wrap, day_mask)
+
+
+def available_backend(backend):
+    # Name of the backend to use for backend: "numpy" instead of "numba" (with a warning) if numba is not installed
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, use one of {', '.join(BACKENDS)}")
+    if backend == "numba" and numba is None:
+        warnings.warn("numba is not installed, the numpy backend is used")
+        return "numpy"
+    return backend
+
+
+def backend_stat(backend):
+    # Function with the arguments and output of engine.season_stat for a backend (see available_backend)
+    return kernel_stat if available_backend(backend) == "numba" else season_stat
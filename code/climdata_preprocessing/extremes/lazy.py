@@ -0,0 +1,146 @@
+## DASK-BACKED LAZY MODE
+
+# Opt-in alternative to run.run_all for machines where even one latitude band of all crops does not fit in memory,
+# or to let a dask scheduler (local or distributed) handle the scheduling. Requires the dask package.
+
+# The decade files are opened with explicit chunks: the full time axis and lat_chunk latitude rows per chunk. Every
+# chunk is computed independently by the batched engine (masking, percentile thresholds and run lengths are all
+# per grid cell along time, so they are chunk-wise operations). The indicators are written to the netcdf files chunk by
+# chunk in one dask computation, so the daily data cube is never held in memory as a whole and each chunk of climate
+# data is read and processed only once for all indicators and crops.
+
+import dask
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .data import CROP_NAMES, climate_files, output_path
+from .engine import family_percentiles, indicator_spec
+from .kernel import available_backend, backend_stat
+from .run import load_seasons
+from .timeindex import TimeIndex
+
+
+def open_climate_lazy(repo_path, variable, lat_chunk):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - variable: climate variable ("tasmax" or "pr")
+    # - lat_chunk: number of latitude rows per chunk
+    # OUTPUT:
+    # - dask-backed xarray data array (time, lat, lon), chunked with the full time axis per chunk
+
+    climate = xr.open_mfdataset(climate_files(repo_path, variable), engine="netcdf4", combine="nested", concat_dim="time",
+                                chunks={"lat": lat_chunk, "lon": -1})
+    return climate[variable].transpose("time", "lat", "lon").chunk({"time": -1})
+
+
+def season_grid(seasons, lats, lons):
+    # INPUT:
+    # - seasons: dictionary {crop: (cropdat, start_day, end_day, day_mask)} (see run.load_seasons)
+    # - lats, lons: coordinates of the climate grid
+    # OUTPUT:
+    # - numpy arrays (crop, lat, lon) with the start and end day of every crop's season on the climate grid (NaN if none)
+
+    start = np.full((len(seasons), len(lats), len(lons)), np.nan)
+    end = np.full((len(seasons), len(lats), len(lons)), np.nan)
+    lat_index = pd.Index(lats)
+    lon_index = pd.Index(lons)
+    for i, (cropdat, start_day, end_day, day_mask) in enumerate(seasons.values()):
+        if day_mask is not None:
+            raise ValueError("The union season of the crop aggregate (aggr_union) is not available in the lazy mode")
+        rows = lat_index.get_indexer(cropdat["lat"])
+        cols = lon_index.get_indexer(cropdat["lon"])
+        start[i, rows, cols] = start_day
+        end[i, rows, cols] = end_day
+    return start, end
+
+
+def block_stat(values, start, end, time, family, percentiles, names, backend="numpy"):
+    # INPUT:
+    # - values: numpy array (time, lat, lon) of one chunk
+    # - start, end: numpy arrays (crop, lat, lon) with the growing seasons of the chunk
+    # - time: timeindex.TimeIndex of the chunk's time axis
+    # - family, percentiles: passed on to engine.season_stat
+    # - names: indicator names in the order of the output
+    # - backend: "numpy" or "numba" (see kernel.py)
+    # OUTPUT:
+    # - numpy array (indicator, year, crop, lat, lon)
+
+    n_times, n_lats, n_lons = values.shape
+    n_crops = start.shape[0]
+    n_years = len(time.years)
+    out = np.zeros((len(names), n_years, n_crops, n_lats * n_lons))
+
+    # Only the grid cells with a season are computed (the engine returns 0 for the others anyway)
+    crops, cells = np.nonzero(~np.isnan(start.reshape(n_crops, -1)))
+    if len(cells):
+        _, stats = backend_stat(backend)(values.reshape(n_times, -1), time, start.reshape(n_crops, -1)[crops, cells],
+                               end.reshape(n_crops, -1)[crops, cells], family, percentiles, cell_index=cells)
+        for k, name in enumerate(names):
+            out[k][:, crops, cells] = stats[name]
+    return out.reshape(len(names), n_years, n_crops, n_lats, n_lons)
+
+
+def lazy_indicators(climate, seasons, family, percentiles=None, backend="numpy"):
+    # INPUT:
+    # - climate: dask-backed xarray data array (time, lat, lon) with the full time axis per chunk (see open_climate_lazy)
+    # - seasons: dictionary {crop: (cropdat, start_day, end_day)}
+    # - family: "hot" or "drywet"
+    # - percentiles: optional dictionary {frequency indicator: percentile}
+    # - backend: "numpy" or "numba" (see kernel.py)
+    # OUTPUT:
+    # - dictionary {crop: {indicator: lazy xarray data array (year, lat, lon)}}
+
+    spec = indicator_spec(family, percentiles)
+    if spec.get("sweep"):
+        raise ValueError("Percentile sweeps are not available in the lazy mode")
+    names = [name for extreme in spec["extremes"] for name in extreme[:2]] + ([spec["total"]] if spec["total"] else [])
+    time = TimeIndex(climate["time"].values)
+    years = time.years
+    lats, lons = climate["lat"].values, climate["lon"].values
+
+    start, end = season_grid(seasons, lats, lons)
+    season_chunks = ((len(seasons),), *climate.data.chunks[1:])
+    stats = da.map_blocks(
+        block_stat, climate.data, da.from_array(start, chunks=season_chunks), da.from_array(end, chunks=season_chunks),
+        time=time, family=family, percentiles=percentiles, names=names, backend=available_backend(backend),
+        new_axis=[0, 1], chunks=((len(names),), (len(years),), *season_chunks), dtype=float
+    )
+
+    # Per crop, the indicators cover the unique coordinates of the crop's grid cells (as grid.to_grid)
+    indicators = {}
+    for i, (crop, (cropdat, _, _, _)) in enumerate(seasons.items()):
+        crop_lats = np.isin(lats, np.unique(cropdat["lat"]))
+        crop_lons = np.isin(lons, np.unique(cropdat["lon"]))
+        indicators[crop] = {}
+        for k, name in enumerate(names):
+            indicator = xr.DataArray(stats[k, :, i], coords={"year": years, "lat": lats, "lon": lons}, dims=["year", "lat", "lon"])
+            indicator.name = None  # unnamed as the eager results, the files are read as __xarray_dataarray_variable__
+            indicators[crop][name] = indicator.isel(lat=crop_lats, lon=crop_lons).sortby("lat").sortby("lon")
+    return indicators
+
+
+def run_lazy(repo_path, families=("hot", "drywet"), crops=(*CROP_NAMES, "aggr"), percentiles=None, lat_chunk=5, use_cache=True,
+             backend="numpy"):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - families: indicator families to compute
+    # - crops: crop names and/or "aggr"
+    # - percentiles: optional dictionary {frequency indicator: percentile}
+    # - lat_chunk: number of latitude rows per chunk
+    # - use_cache: reuse the growing season tables saved by earlier runs (see run.load_seasons)
+    # - backend: "numpy" or "numba" (see kernel.py)
+    # OUTPUT:
+    # - none, the indicators are written to their netcdf files (see data.output_path)
+
+    seasons = load_seasons(repo_path, list(crops), use_cache)
+    writes = []
+    for family in families:
+        climate = open_climate_lazy(repo_path, indicator_spec(family)["variable"], lat_chunk)
+        for crop, indicators in lazy_indicators(climate, seasons, family, family_percentiles(family, percentiles), backend).items():
+            for name, indicator in indicators.items():
+                writes.append(indicator.to_netcdf(output_path(repo_path, name, crop), compute=False))
+
+    # One computation for all files, so that every chunk is computed once for all indicators and crops
+    dask.compute(*writes)
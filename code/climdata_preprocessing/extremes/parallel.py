@@ -0,0 +1,79 @@
+## PARALLEL EXECUTION OVER LATITUDE BANDS
+
+# Every grid cell is independent, so the latitude bands of compute_indicators can be processed by a pool of worker
+# processes. The climate data is not copied to the workers: a worker receives the paths of the decade files and reads
+# the hyperslab of its own band from them (see reader.py), so the bands are read in parallel as well. Only the
+# (year, season) results of a band are sent back to the main process, which puts them in place in the output arrays.
+
+import time as timer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import xarray as xr
+
+from .cellcache import CellCache
+from .engine import season_thresholds
+from .kernel import backend_stat
+from .reader import read_cells
+
+
+def climate_sources(decades):
+    # File paths of the decade datasets if they were opened from files, otherwise the datasets themselves
+    paths = [decade.encoding.get("source") for decade in decades]
+    if all(paths):
+        return paths
+    return decades
+
+
+def band_stat(sources, variable, lats, lons, time, start_day, end_day, family, percentiles, cell_index, thresholds=None,
+              years=None, backend="numpy", day_mask=None):
+    # INPUT:
+    # - sources: decade file paths or datasets (see climate_sources), or cellcache.CellCache
+    # - variable: climate variable
+    # - lats, lons: coordinates of the grid cells of the band
+    # - years: optional (first year, last year) of the climate data to read (see reader.year_slice)
+    # - backend: "numpy" (engine.season_stat) or "numba" (see kernel.py)
+    # - the other arguments are passed on to engine.season_stat
+    # OUTPUT:
+    # - years and stats of engine.season_stat for the seasons of the band
+    # - thresholds (extreme, season) used for the seasons of the band (see engine.season_thresholds)
+    # - time in seconds of the read, threshold and season_stat stages (see profiling.py)
+
+    stages = {}
+    start = timer.perf_counter()
+    if isinstance(sources, CellCache):
+        values = sources.read(lats, lons, years)
+    else:
+        decades = [xr.open_dataset(source, engine="netcdf4") if isinstance(source, str) else source for source in sources]
+        values = read_cells(decades, variable, lats, lons, years)
+        for decade, source in zip(decades, sources):
+            if isinstance(source, str):
+                decade.close()
+    stages["read"] = timer.perf_counter() - start
+
+    start = timer.perf_counter()
+    thresholds = season_thresholds(values, time, start_day, end_day, family, percentiles, cell_index, thresholds, day_mask)
+    stages["threshold"] = timer.perf_counter() - start
+
+    start = timer.perf_counter()
+    years, stats = backend_stat(backend)(values, time, start_day, end_day, family, percentiles, cell_index, thresholds,
+                                         day_mask=day_mask)
+    stages["season_stat"] = timer.perf_counter() - start
+    return years, stats, thresholds, stages
+
+
+def map_bands(tasks, workers=1):
+    # INPUT:
+    # - tasks: list of argument tuples for band_stat
+    # - workers: number of worker processes (1 runs the bands one after the other in the current process)
+    # OUTPUT:
+    # - generator of (task number, band_stat result) in order of completion
+
+    if workers <= 1:
+        for number, task in enumerate(tasks):
+            yield number, band_stat(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(band_stat, *task): number for number, task in enumerate(tasks)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -0,0 +1,59 @@
+## BATCHED PERCENTILES OF THE GROWING SEASON DAYS
+
+# np.nanquantile (and xarray's .quantile with skipna) handles every grid cell separately when the data contains NaN
+# (np.apply_along_axis over the cells), and it does so once per percentile. Here the growing season days of all grid
+# cells are ordered in one vectorized call on a cell-major copy (NaN values are placed after all valid values), and all
+# percentiles of all grid cells are then read from the same ordered block (e.g. the 5th and 95th percentile of pr at once).
+
+# The days are ordered with np.sort rather than np.partition: with the vectorized sorting of numpy >= 2 a full sort of
+# a contiguous block is several times faster than a partial selection, and it gives the order statistics of every grid
+# cell whatever its number of valid days.
+
+# The interpolation is done in float64 whatever the precision of the values, as xarray's .quantile returns float64 for
+# the float32 GSWP3-W5E5 data: a float32 threshold would be rounded and change the days that lie exactly on it. It
+# reproduces np.nanquantile of the values in float64 (method "linear", the default of xarray) bit for bit, including
+# its floating point rounding (virtual index (n - 1) * q and the two-sided linear interpolation).
+
+import numpy as np
+
+
+def _lerp(a, b, gamma):
+    # Linear interpolation between a and b as numpy's _lerp (all float64)
+    diff = b - a
+    lower = a + diff * gamma
+    upper = b - diff * (1 - gamma)
+    return np.where(gamma >= 0.5, upper, lower)
+
+
+def nan_quantiles(values, quantiles):
+    # INPUT:
+    # - values: numpy float array (time, cell), NaN for the days that are not counted (outside the growing season or missing)
+    # - quantiles: list of quantiles between 0 and 1 (e.g. [0.05, 0.95])
+    # OUTPUT:
+    # - float64 numpy array (quantile, cell) with the same values as np.nanquantile(values.astype(np.float64), q, axis=0)
+    #   for every q. NaN for the grid cells without any valid value.
+
+    values = np.asarray(values)
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(float)
+    result = np.full((len(quantiles), values.shape[1]), np.nan)
+
+    n_valid = (~np.isnan(values)).sum(axis=0)
+    cells = np.flatnonzero(n_valid > 0)
+    if not len(cells):
+        return result
+    n_valid = n_valid[cells]
+
+    # One ordering of the days of every grid cell for all percentiles (in the precision of values, the order is the same)
+    ordered = np.sort(np.ascontiguousarray(values[:, cells].T), axis=1)
+    rows = np.arange(len(cells))
+    for k, q in enumerate(quantiles):
+        # Positions of the order statistics around the percentile and interpolation weight (as numpy's _get_indexes
+        # and _get_gamma): the last valid value if the percentile is at or beyond it
+        virtual = (n_valid - 1) * np.float64(q)
+        previous = np.floor(virtual)
+        gamma = virtual - previous
+        previous = np.minimum(previous.astype(int), n_valid - 1)
+        following = np.minimum(previous + 1, n_valid - 1)
+        result[k, cells] = _lerp(ordered[rows, previous].astype(np.float64), ordered[rows, following].astype(np.float64), gamma)
+    return result
@@ -0,0 +1,102 @@
+## PROGRESS AND PROFILING OF A RUN
+
+# A run over the global grid takes long, so the time of every stage is measured and the progress is printed after
+# every latitude band: grid cells done, grid cells per second, estimated time left and peak memory (RSS). The stages are
+# - seasons: loading (or resolving) the growing seasons of the crops
+# - read: reading and decoding the climate data of the bands from the netcdf files
+# - threshold: the percentile thresholds (percentile.py)
+# - season_stat: counting the extreme days and the longest spells (engine.season_stat)
+# - write: saving the indicators (timed by the caller, see indicators_all.py)
+# With workers > 1 the read, threshold and season_stat times are summed over the worker processes, so they can exceed
+# the wall time. The profile can be saved as a json file at the end of a run.
+
+import json
+import sys
+import time as timer
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss():
+    # Peak resident memory (bytes) of this process and of its finished worker processes, None if unknown
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return scale * max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+
+def _duration(seconds):
+    # Seconds as h:mm:ss
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class Profile:
+    # Stage timers and progress of a run. With enabled=False nothing is printed (the stages are still timed).
+
+    def __init__(self, enabled=True, stream=None):
+        self.enabled = enabled
+        self.stream = stream
+        self.stages = {}
+        self.tasks = []
+        self.started = timer.perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        # Time the code in a with block as a stage
+        start = timer.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, timer.perf_counter() - start)
+
+    def start_task(self, label, cells):
+        # Start a sweep over the climate data (e.g. one indicator family) of a number of grid cells
+        self.tasks.append({"task": label, "cells": cells, "done": 0, "seconds": 0.0, "start": timer.perf_counter()})
+
+    def progress(self, cells, stages=None):
+        # Record that a number of grid cells of the current task are done, with their stage times {stage: seconds}
+        task = self.tasks[-1]
+        task["done"] += cells
+        task["seconds"] = timer.perf_counter() - task["start"]
+        for stage, seconds in (stages or {}).items():
+            self.add(stage, seconds)
+        if self.enabled:
+            rate = task["done"] / task["seconds"] if task["seconds"] > 0 else float("inf")
+            eta = (task["cells"] - task["done"]) / rate if rate > 0 else 0
+            rss = peak_rss()
+            print(f"{task['task']}: {task['done']}/{task['cells']} grid cells ({100 * task['done'] / max(task['cells'], 1):.0f}%), "
+                  f"{rate:.0f} cells/s, ETA {_duration(eta)}" + (f", peak RSS {rss / 2**30:.2f} GB" if rss else ""),
+                  file=self.stream or sys.stdout, flush=True)
+
+    def summary(self):
+        # Dictionary with the wall time, the stage times, the tasks (grid cells, time, cells per second) and the peak RSS
+        return {
+            "seconds": timer.perf_counter() - self.started,
+            "stages": dict(self.stages),
+            "tasks": [{"task": task["task"], "cells": task["cells"], "seconds": task["seconds"],
+                       "cells_per_second": task["done"] / task["seconds"] if task["seconds"] > 0 else None}
+                      for task in self.tasks],
+            "peak_rss": peak_rss(),
+        }
+
+    def report(self):
+        # Print the stage times (if enabled)
+        if not self.enabled:
+            return
+        summary = self.summary()
+        stages = ", ".join(f"{stage} {_duration(seconds)}" for stage, seconds in summary["stages"].items())
+        print(f"Total {_duration(summary['seconds'])} ({stages})", file=self.stream or sys.stdout, flush=True)
+
+    def dump(self, path):
+        # Save the summary as a json file
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=1)
@@ -0,0 +1,72 @@
+## STREAMING READER FOR THE DECADE FILES OF THE CLIMATE DATA
+
+# The GSWP3-W5E5 files are stored time-major, one file per decade. Joining them with xr.concat decodes the full
+# global grid, and selecting one grid cell at a time reads a strided value from every daily slice. Instead, the
+# grid cells are processed in latitude bands: for every band, only the rows of the band are read from each decade
+# file (one contiguous hyperslab per file) and joined along time. Memory is bounded by the size of one band.
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def as_decades(climate):
+    # A single (already joined) climate dataset or a list of decade datasets, as a list of datasets
+    if isinstance(climate, xr.Dataset):
+        return [climate]
+    return list(climate)
+
+
+def year_slice(time, years=None):
+    # Slice of the (sorted) time stamps within years = (first year, last year), None for no limit on either side
+    if years is None:
+        return slice(None)
+    year = pd.DatetimeIndex(time).year.values
+    first, last = years
+    start = 0 if first is None else np.searchsorted(year, first, side="left")
+    stop = len(year) if last is None else np.searchsorted(year, last, side="right")
+    return slice(start, stop)
+
+
+def climate_time(decades, years=None):
+    # Time stamps of the decade datasets joined along time (only the given years, see year_slice)
+    return np.concatenate([decade["time"].values[year_slice(decade["time"].values, years)] for decade in decades])
+
+
+def latitude_bands(decades, lats, tile_rows):
+    # INPUT:
+    # - decades: list of climate datasets (see as_decades)
+    # - lats: latitude of every grid cell
+    # - tile_rows: number of latitude rows of the climate grid per band
+    # OUTPUT:
+    # - list with the indices of the grid cells in every band
+
+    rows = decades[0].indexes["lat"].get_indexer(np.asarray(lats))
+    if (rows < 0).any():
+        raise KeyError(f"Latitude(s) {np.unique(np.asarray(lats)[rows < 0])} not in the climate grid")
+    band = rows // tile_rows
+    return [np.flatnonzero(band == b) for b in np.unique(band)]
+
+
+def read_cells(decades, variable, lats, lons, years=None):
+    # INPUT:
+    # - decades: list of climate datasets (see as_decades)
+    # - variable: climate variable
+    # - lats, lons: coordinates of the grid cells
+    # - years: optional (first year, last year) to read (see year_slice)
+    # OUTPUT:
+    # - numpy array (time, cell) with the daily series of every grid cell over all decades
+
+    parts = []
+    for decade in decades:
+        data = decade[variable].isel(time=year_slice(decade["time"].values, years))
+        rows = data.indexes["lat"].get_indexer(np.asarray(lats))
+        cols = data.indexes["lon"].get_indexer(np.asarray(lons))
+        if (rows < 0).any() or (cols < 0).any():
+            raise KeyError("Grid cell(s) not in the climate grid")
+
+        # Read the bounding box of the grid cells in one go and pick the cells from it
+        row0, col0 = rows.min(), cols.min()
+        box = data.isel(lat=slice(row0, rows.max() + 1), lon=slice(col0, cols.max() + 1)).transpose("time", "lat", "lon").values
+        parts.append(box[:, rows - row0, cols - col0])
+    return np.concatenate(parts, axis=0)
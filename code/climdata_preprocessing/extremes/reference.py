@@ -0,0 +1,324 @@
+## REFERENCE RUNNER FOR THE EQUIVALENCE OF FASTER ENGINES
+
+# The per-cell season_stat loop of the original indicators_*.py scripts, kept as the reference that any faster engine
+# (engine.season_stat or a later backend) must reproduce: one grid cell and one year at a time, with xarray's quantile,
+# the extreme_length loop and the hard-coded zeroing of the seasons spanning two calendar years in the last year of
+# the record (year == 2019 in the original scripts). The growing seasons are resolved beforehand (seasons.py follows
+# the rules of the original loop), so the reference takes the same (time, cell) input as the engine.
+# The loop is slow: use it on small synthetic inputs (see bench.py) or on a region of the real data. Run from
+# code/climdata_preprocessing, e.g.
+#   python -m extremes.reference --lat 8 --lon 10 --years 1981 2019
+#   python -m extremes.reference --repo-path /data --crops mai --bbox 45 47 5 7
+
+import argparse
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .data import CROP_NAMES
+from .engine import INDICATORS, indicator_spec, season_days, season_stat
+from .kernel import BACKENDS, backend_stat
+from .seasons import union_bounds
+
+
+def extreme_length(array):
+    # INPUT:
+    # - Array where we want to find maximum length of consecutive extreme days
+    # OUTPUT:
+    # - Maximum length of extreme days
+
+    max_length = 0
+    current_length = 0
+    for value in array:
+        if value == 1:
+            current_length += 1
+            max_length = max(max_length, current_length)
+        else:
+            current_length = 0
+    return max_length
+
+
+def _binary(values, threshold, side):
+    # Extreme days of the original scripts: >= the threshold for "above", <= for "below"
+    return values >= threshold if side == "above" else values <= threshold
+
+
+def reference_cell(climate_loc, start_day_loc, end_day_loc, family, percentiles=None):
+    # INPUT:
+    # - climate_loc: xarray data array (time) with the daily series of one grid cell
+    # - start_day_loc, end_day_loc: growing season of the grid cell (NaN if it has none)
+    # - family: indicator family ("hot" or "drywet")
+    # - percentiles: optional dictionary {frequency indicator: percentile}
+    # OUTPUT:
+    # - dictionary with a numpy array (year) for every indicator of the family
+
+    spec = indicator_spec(family, percentiles)
+    unique_years = np.unique(climate_loc["time.year"].values)
+    names = [name for extreme in spec["extremes"] for name in extreme[:2]] + ([spec["total"]] if spec["total"] else [])
+    stats = {name: pd.Series(np.zeros(len(unique_years)), index=unique_years) for name in names}
+    dayofyear = climate_loc["time"].dt.dayofyear
+
+    # Handle growing seasons within the same year
+    if start_day_loc <= end_day_loc:
+        climate_loc_growing = climate_loc.where((dayofyear >= start_day_loc) & (dayofyear <= end_day_loc), drop=True)
+        thresholds = [climate_loc_growing.quantile(q, dim="time", skipna=True) for _, _, q, _ in spec["extremes"]]
+
+        for year in unique_years:
+            climate_current = climate_loc.sel(time=climate_loc["time.year"] == year)
+            dayofyear_current = climate_current["time"].dt.dayofyear
+            climate_current_growing = climate_current.sel(time=(dayofyear_current >= start_day_loc) & (dayofyear_current <= end_day_loc))
+            total_days = end_day_loc - start_day_loc + 1
+            for threshold, (frequency, spell, _, side) in zip(thresholds, spec["extremes"]):
+                binary_current = _binary(climate_current_growing, threshold, side).astype(int)
+                stats[frequency][year] = float(binary_current.sum(dim="time") / total_days)
+                stats[spell][year] = extreme_length(binary_current.values)
+            if spec["total"]:
+                stats[spec["total"]][year] = float(climate_current_growing.sum(dim="time"))
+
+    # Handle growing seasons spanning two calendar years
+    if end_day_loc < start_day_loc:
+        climate_loc_growing = climate_loc.where((dayofyear >= start_day_loc) | (dayofyear <= end_day_loc), drop=True)
+        thresholds = [climate_loc_growing.quantile(q, dim="time", skipna=True) for _, _, q, _ in spec["extremes"]]
+
+        for year in unique_years:
+            current_year = year + 1
+            # Last year is not a complete growing season (year == 2019 in the original scripts)
+            if year == unique_years[-1]:
+                for name in names:
+                    stats[name][year] = 0
+                continue
+            climate_current = climate_loc.sel(time=climate_loc["time.year"] == current_year)
+            climate_previous = climate_loc.sel(time=climate_loc["time.year"] == year)
+            dayofyear_current = climate_current["time"].dt.dayofyear
+            dayofyear_previous = climate_previous["time"].dt.dayofyear
+            total_days = (365 - start_day_loc + 1) + end_day_loc
+            climate_current_growing = climate_current.sel(time=dayofyear_current <= end_day_loc)
+            climate_previous_growing = climate_previous.sel(time=dayofyear_previous >= start_day_loc)
+            for threshold, (frequency, spell, _, side) in zip(thresholds, spec["extremes"]):
+                binary_current = _binary(climate_current_growing, threshold, side)
+                binary_previous = _binary(climate_previous_growing, threshold, side)
+                days = binary_current.astype(int).sum(dim="time") + binary_previous.astype(int).sum(dim="time")
+                stats[frequency][current_year] = float(days / total_days)
+                stats[spell][current_year] = extreme_length(xr.concat([binary_previous, binary_current], dim="time").values.astype(int))
+            if spec["total"]:
+                stats[spec["total"]][current_year] = float(climate_current_growing.sum(dim="time") + climate_previous_growing.sum(dim="time"))
+
+    return {name: series.values for name, series in stats.items()}
+
+
+def reference_union_cell(climate_loc, day_mask_loc, family, percentiles=None):
+    # INPUT:
+    # - climate_loc: xarray data array (time) with the daily series of one grid cell
+    # - day_mask_loc: boolean numpy array (366) with the growing season days of year of a union season within the
+    #   calendar year (see seasons.union_season), e.g. two disjoint seasons
+    # - family, percentiles: see reference_cell
+    # OUTPUT:
+    # - dictionary with a numpy array (year) for every indicator of the family, as reference_cell with the growing
+    #   season days of the mask: the days between disjoint seasons are not counted and end a spell
+
+    spec = indicator_spec(family, percentiles)
+    unique_years = np.unique(climate_loc["time.year"].values)
+    names = [name for extreme in spec["extremes"] for name in extreme[:2]] + ([spec["total"]] if spec["total"] else [])
+    stats = {name: pd.Series(np.zeros(len(unique_years)), index=unique_years) for name in names}
+    in_season = xr.DataArray(day_mask_loc[climate_loc["time"].dt.dayofyear.values - 1], coords=climate_loc.coords)
+    climate_loc_growing = climate_loc.where(in_season, drop=True)
+    thresholds = [climate_loc_growing.quantile(q, dim="time", skipna=True) for _, _, q, _ in spec["extremes"]]
+    total_days = day_mask_loc[:365].sum()
+
+    for year in unique_years:
+        climate_current = climate_loc.sel(time=climate_loc["time.year"] == year)
+        in_season_current = in_season.sel(time=climate_current["time"])
+        for threshold, (frequency, spell, _, side) in zip(thresholds, spec["extremes"]):
+            binary_current = (_binary(climate_current, threshold, side) & in_season_current).astype(int)
+            stats[frequency][year] = float(binary_current.sum(dim="time") / total_days)
+            stats[spell][year] = extreme_length(binary_current.values)
+        if spec["total"]:
+            stats[spec["total"]][year] = float(climate_current.where(in_season_current).sum(dim="time"))
+
+    return {name: series.values for name, series in stats.items()}
+
+
+def reference_stat(values, time, start_day, end_day, family, percentiles=None):
+    # INPUT:
+    # - values: numpy array (time, cell) with the daily climate variable
+    # - time: time stamps of the rows of values
+    # - start_day, end_day: growing season of every grid cell
+    # - family, percentiles: see engine.indicator_spec
+    # OUTPUT:
+    # - years and dictionary {indicator: numpy array (year, cell)}, as engine.season_stat
+
+    time = pd.DatetimeIndex(time)
+    years = np.unique(time.year.values)
+    stats = {}
+    for cell in range(values.shape[1]):
+        climate_loc = xr.DataArray(values[:, cell], coords={"time": time}, dims="time")
+        for name, series in reference_cell(climate_loc, start_day[cell], end_day[cell], family, percentiles).items():
+            stats.setdefault(name, np.zeros((len(years), values.shape[1])))[:, cell] = series
+    return years, stats
+
+
+def compare(expected, actual, cells, years, rtol=1e-6, atol=0, max_report=10):
+    # INPUT:
+    # - expected, actual: dictionaries {indicator: numpy array (year, cell)} of the reference and of the tested engine
+    # - cells: dataframe with the lat and lon of the grid cells
+    # - years: years of the rows
+    # - rtol, atol: tolerances (as np.isclose: |actual - expected| <= atol + rtol * |expected|)
+    # - max_report: number of mismatches to report
+    # OUTPUT:
+    # - number of mismatching values and list with the first max_report mismatches (in the order indicator, year,
+    #   grid cell), as dictionaries
+
+    n_mismatches, first = 0, []
+    for name in expected:
+        if name not in actual:
+            raise KeyError(f"Indicator {name} is missing in the tested output")
+        close = np.isclose(actual[name], expected[name], rtol=rtol, atol=atol, equal_nan=True)
+        n_mismatches += (~close).sum()
+        for i, j in np.argwhere(~close)[:max_report - len(first)]:
+            first.append({"indicator": name, "year": int(years[i]), "lat": float(cells["lat"].iloc[j]), "lon": float(cells["lon"].iloc[j]),
+                          "expected": float(expected[name][i, j]), "actual": float(actual[name][i, j])})
+    return int(n_mismatches), first
+
+
+def check_engine(values, time, cells, start_day, end_day, family, percentiles=None, engine=season_stat, rtol=1e-6, atol=0,
+                 max_report=10):
+    # INPUT:
+    # - values, time, cells, start_day, end_day: daily climate variable (time, cell) and growing seasons of the grid cells
+    # - family, percentiles: see engine.indicator_spec
+    # - engine: function with the arguments and output of engine.season_stat (values, time, start_day, end_day, family,
+    #   percentiles) to test against the reference
+    # - rtol, atol, max_report: see compare
+    # OUTPUT:
+    # - number of mismatching values and the first mismatches (see compare)
+
+    years, expected = reference_stat(values, time, start_day, end_day, family, percentiles)
+    engine_years, actual = engine(values, time, start_day, end_day, family, percentiles)
+    if not np.array_equal(years, engine_years):
+        raise ValueError(f"Years of the tested output {engine_years} differ from the reference {years}")
+    return compare(expected, actual, cells, years, rtol, atol, max_report)
+
+
+def tie_case(seed=0):
+    # Synthetic grid cell whose tasmax lies exactly on the FHD threshold: the two days around the 95th percentile of its
+    # growing season (1 to 100 January to April, 2001-2005: 500 days, percentile at 474.05) are adjacent float32 values,
+    # so the threshold rounded to float32 equals the lower one while the float64 threshold of xarray is above it
+    # OUTPUT:
+    # - values (time, 1) float32, time stamps, cells, start_day and end_day, as the inputs of check_engine
+
+    rng = np.random.default_rng(seed)
+    time = pd.date_range("2001-01-01", "2005-12-31", freq="D")
+    values = (295 + rng.normal(0, 4, len(time))).astype(np.float32)
+    start_day, end_day = np.array([1.0]), np.array([100.0])
+    growing = np.flatnonzero(time.dayofyear <= end_day[0])
+    order = growing[np.argsort(values[growing], kind="stable")]
+    position = int(np.floor((len(growing) - 1) * INDICATORS["hot"]["extremes"][0][2]))
+    values[order[position + 1]] = np.nextafter(values[order[position]], np.float32(np.inf))
+    return values[:, None], time.values, pd.DataFrame({"lat": [0.25], "lon": [0.25]}), start_day, end_day
+
+
+def check_union(family, seed=0, engine=season_stat, rtol=1e-6, atol=0, max_report=10):
+    # INPUT:
+    # - family: indicator family
+    # - seed: seed of the synthetic climate data
+    # - engine, rtol, atol, max_report: see check_engine (the engine also takes the day_mask argument)
+    # OUTPUT:
+    # - number of mismatching values and the first mismatches (see compare) of a synthetic grid cell whose union season
+    #   is two disjoint seasons within the calendar year (days 10 to 50 and 200 to 250), against reference_union_cell
+
+    from .bench import synthetic_climate
+
+    variable = indicator_spec(family)["variable"]
+    climate_loc = synthetic_climate(1, 1, 2011, 2019, seed=seed)[variable][variable][:, 0, 0]
+    day_mask = season_days(np.array([10.0]), np.array([50.0])) | season_days(np.array([200.0]), np.array([250.0]))
+    start_day, end_day = union_bounds(day_mask)
+    if (start_day[0], end_day[0]) != (10, 250):
+        raise ValueError(f"Union of days 10-50 and 200-250 bounded by {start_day[0]:g}-{end_day[0]:g} instead of 10-250")
+
+    expected = {name: series[:, None] for name, series in reference_union_cell(climate_loc, day_mask[0], family).items()}
+    years, actual = engine(climate_loc.values[:, None], climate_loc["time"].values, start_day, end_day, family, day_mask=day_mask)
+    cells = pd.DataFrame({"lat": climate_loc["lat"].values[None], "lon": climate_loc["lon"].values[None]})
+    return compare(expected, actual, cells, years, rtol, atol, max_report)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m extremes.reference",
+                                     description="Compare the indicator engine with the loop of the original scripts.")
+    parser.add_argument("--repo-path", help="use the data of the repository (with --bbox or --countries) instead of synthetic data")
+    parser.add_argument("--lat", type=int, default=8, help="number of latitude rows of the synthetic grid")
+    parser.add_argument("--lon", type=int, default=10, help="number of longitude columns of the synthetic grid")
+    parser.add_argument("--years", nargs=2, type=int, default=(1981, 2019), metavar=("FIRST", "LAST"),
+                        help="years of the synthetic data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"))
+    parser.add_argument("--countries", nargs="+", metavar="ISO")
+    parser.add_argument("--crops", nargs="+", choices=(*CROP_NAMES, "aggr"), default=("mai", "aggr"))
+    parser.add_argument("--families", nargs="+", choices=tuple(INDICATORS), default=tuple(INDICATORS))
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy", help="engine to test (see kernel.py)")
+    parser.add_argument("--rtol", type=float, default=1e-6)
+    parser.add_argument("--atol", type=float, default=0)
+    parser.add_argument("--max-report", type=int, default=10, help="number of mismatches to print")
+    args = parser.parse_args(argv)
+
+    if args.repo_path:
+        from pathlib import Path
+
+        from .data import open_climate
+        from .reader import climate_time, read_cells
+        from .region import make_region, select_cells
+        from .run import load_seasons
+
+        repo_path = Path(args.repo_path)
+        region = make_region(repo_path, args.bbox, args.countries)
+        if region is None:
+            parser.error("--repo-path needs --bbox or --countries (the reference loop is too slow for the full grid)")
+        seasons = load_seasons(repo_path, args.crops)
+        seasons = select_cells(seasons, {crop: region(cells) for crop, (cells, _, _, _) in seasons.items()})
+
+        def inputs(variable, cells):
+            decades = open_climate(repo_path, variable)
+            return read_cells(decades, variable, cells["lat"].values, cells["lon"].values), climate_time(decades)
+    else:
+        from .bench import synthetic_climate, synthetic_seasons
+
+        climate = synthetic_climate(args.lat, args.lon, *args.years, seed=args.seed)
+        seasons = synthetic_seasons(climate["tasmax"]["lat"].values, climate["tasmax"]["lon"].values, args.crops, seed=args.seed)
+
+        def inputs(variable, cells):
+            points = dict(lat=xr.DataArray(cells["lat"].values, dims="cell"), lon=xr.DataArray(cells["lon"].values, dims="cell"))
+            data = climate[variable][variable].sel(**points).transpose("time", "cell")
+            return data.values, data["time"].values
+
+    failed = False
+    for crop, (cells, start_day, end_day, _) in seasons.items():
+        for family in args.families:
+            values, time = inputs(indicator_spec(family)["variable"], cells)
+            n_mismatches, first = check_engine(values, time, cells, start_day, end_day, family, engine=backend_stat(args.backend),
+                                               rtol=args.rtol, atol=args.atol, max_report=args.max_report)
+            print(f"{crop} {family}: {len(cells)} grid cells, {n_mismatches} mismatching values")
+            for mismatch in first:
+                print("  " + ", ".join(f"{key}={value}" for key, value in mismatch.items()))
+            failed |= n_mismatches > 0
+    if not args.repo_path and "hot" in args.families:
+        # A day on the rounded threshold, which random data rarely gives (see tie_case)
+        values, time, cells, start_day, end_day = tie_case(args.seed)
+        n_mismatches, first = check_engine(values, time, cells, start_day, end_day, "hot", engine=backend_stat(args.backend),
+                                           rtol=args.rtol, atol=args.atol, max_report=args.max_report)
+        print(f"tie hot: 1 grid cell, {n_mismatches} mismatching values")
+        for mismatch in first:
+            print("  " + ", ".join(f"{key}={value}" for key, value in mismatch.items()))
+        failed |= n_mismatches > 0
+    if not args.repo_path:
+        # Union season of the crop aggregate (--aggr-union) made of two disjoint seasons within the calendar year
+        for family in args.families:
+            n_mismatches, first = check_union(family, args.seed, backend_stat(args.backend), args.rtol, args.atol, args.max_report)
+            print(f"union {family}: 1 grid cell, {n_mismatches} mismatching values")
+            for mismatch in first:
+                print("  " + ", ".join(f"{key}={value}" for key, value in mismatch.items()))
+            failed |= n_mismatches > 0
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+## REGION SELECTION
+
+# Restricts a run to the grid cells of a region (a lat/lon bounding box and/or a set of countries of the ISIMIP
+# country mask), e.g. for quick regional test runs. A region is given as a function that takes the dataframe with the
+# lat and lon of the grid cells of a crop and returns a boolean numpy array (True for the grid cells to keep).
+
+import numpy as np
+import xarray as xr
+
+COUNTRYMASK_FILE = "GGCMI-validation/data/raw/other/countrymasks.nc"
+
+
+def in_bbox(cells, bbox):
+    # Grid cells within bbox = (lat_min, lat_max, lon_min, lon_max), bounds included
+    lat_min, lat_max, lon_min, lon_max = bbox
+    lats, lons = cells["lat"].values, cells["lon"].values
+    return (lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) & (lons <= lon_max)
+
+
+def in_countries(cells, countrymask, countries):
+    # INPUT:
+    # - cells: dataframe with the lat and lon of the grid cells
+    # - countrymask: xarray dataset of the ISIMIP country mask, with one m_<ISO code> variable per country
+    # - countries: ISO codes of the countries (e.g. ["BEL", "NLD"])
+    # OUTPUT:
+    # - boolean numpy array, True for the grid cells in one of the countries
+
+    unknown = [iso for iso in countries if f"m_{iso}" not in countrymask]
+    if unknown:
+        raise ValueError(f"No country {unknown} in the country mask")
+    mask = sum((countrymask[f"m_{iso}"] > 0).astype(int) for iso in countries) > 0
+    points = dict(lat=xr.DataArray(cells["lat"].values, dims="cell"), lon=xr.DataArray(cells["lon"].values, dims="cell"))
+    return mask.sel(**points, method="nearest").values
+
+
+def make_region(repo_path, bbox=None, countries=None):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - bbox: optional (lat_min, lat_max, lon_min, lon_max)
+    # - countries: optional ISO codes of countries of the country mask (COUNTRYMASK_FILE)
+    # OUTPUT:
+    # - region function (see above) for the grid cells within the bounding box and the countries, or None if neither
+    #   is given
+
+    if bbox is None and not countries:
+        return None
+    countrymask = xr.load_dataset(repo_path / COUNTRYMASK_FILE) if countries else None
+
+    def region(cells):
+        keep = np.ones(len(cells), dtype=bool)
+        if bbox is not None:
+            keep &= in_bbox(cells, bbox)
+        if countries:
+            keep &= in_countries(cells, countrymask, countries)
+        return keep
+
+    return region
+
+
+def select_cells(seasons, keep):
+    # Growing seasons {crop: (cells, start_day, end_day, day_mask)} restricted to the grid cells in keep {crop: boolean array}
+    return {crop: (cells[keep[crop]].reset_index(drop=True), start_day[keep[crop]], end_day[keep[crop]],
+                   None if day_mask is None else day_mask[keep[crop]])
+            for crop, (cells, start_day, end_day, day_mask) in seasons.items()}
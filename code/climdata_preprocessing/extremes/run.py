@@ -0,0 +1,417 @@
+## COMPUTATION OF THE EXTREME CLIMATE INDICATORS
+
+# Ties the data loading, the growing season resolution and the batched engine together. An indicator family
+# ("hot": FHD, LHS from tasmax; "drywet": FDD, FWD, TPR, LDS, LWS from pr) is computed for any number of crops
+# (crop specific mode, appendix results) and for the union of all crops (crop = "aggr", main results).
+
+# All crops of a run are computed in the same sweep over the climate data: the daily series of every grid cell
+# is read once and shared by the growing seasons of all crops grown in that cell. The grid cells are processed in
+# latitude bands of tile_rows rows of the climate grid, so the memory use grows with tile_rows and not with the
+# size of the grid (lower tile_rows on small workstations, raise it on large nodes to reduce the number of reads).
+
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .cache import cache_path, fingerprint, load_cached, save_cached
+from .cellcache import CellCache, load_cell_cache
+from .checkpoint import band_key, band_path, load_band, save_band
+from .data import (CROP_NAMES, CROPDATA_FILE, calendar_file, climate_files, load_calendar, load_cropdat, load_cropdat_aggr,
+                   open_climate, output_path, store_path)
+from .engine import INDICATORS, family_percentiles, indicator_spec, season_days, sweep_levels
+from .grid import cells_to_grid, to_cells, to_grid
+from .kernel import available_backend
+from .parallel import climate_sources, map_bands
+from .profiling import Profile
+from .reader import as_decades, climate_time, latitude_bands
+from .region import select_cells
+from .seasons import aggr_season, crop_season, season_table, union_season
+from .store import save_store, to_store
+from .timeindex import TimeIndex
+
+
+def growing_season(cropdat, season_firr_dict, season_noirr_dict, crop, crop_names=CROP_NAMES):
+    # INPUT:
+    # - cropdat: dataframe with one row per grid cell (see load_cropdat and load_cropdat_aggr)
+    # - season_firr_dict, season_noirr_dict: dictionaries of crop calendar xarray datasets per crop
+    # - crop: crop name, or "aggr" for the merged season of all crops in crop_names
+    # OUTPUT:
+    # - start and end day of the growing season for every row of cropdat
+
+    if crop == "aggr":
+        return aggr_season(season_firr_dict, season_noirr_dict, cropdat, crop_names)
+    return crop_season(season_firr_dict[crop], season_noirr_dict[crop], cropdat)
+
+
+def season_inputs(repo_path, crop, crop_names=CROP_NAMES):
+    # Input files of the growing season table of a crop (or "aggr"): crop data and crop calendars
+    calendar_crops = crop_names if crop == "aggr" else [crop]
+    return [repo_path / CROPDATA_FILE] + [calendar_file(repo_path, name, irrigation) for name in calendar_crops for irrigation in ["firr", "noirr"]]
+
+
+def load_seasons(repo_path, crops, use_cache=True, aggr_union=False):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - crops: crop names and/or "aggr"
+    # - use_cache: reuse the growing season tables saved by earlier runs (recomputed when an input file changed)
+    # - aggr_union: merge the seasons of "aggr" into their exact union (see seasons.union_season) instead of extending
+    #   the season to the earliest start and latest end of all crops (aggr_season, as the original scripts)
+    # OUTPUT:
+    # - dictionary {crop: (cells, start_day, end_day, day_mask)} with cells a dataframe with the lat and lon of every
+    #   grid cell and day_mask the boolean numpy array (cell, 366) with the days of year of the union season of "aggr"
+    #   with aggr_union (None otherwise, the season is then every day from start_day to end_day)
+
+    season_firr_dict, season_noirr_dict = {}, {}
+    seasons = {}
+    for crop in crops:
+        union = aggr_union and crop == "aggr"
+        path = cache_path(repo_path, f"season_table_{crop}_union" if union else f"season_table_{crop}")
+        # union tables saved before the within-year bounds of seasons.union_bounds have no version and are computed again
+        key = fingerprint(repo_path, season_inputs(repo_path, crop), **({"union_version": 2} if union else {}))
+        table = load_cached(path, key) if use_cache else None
+
+        if table is None:
+            # Resolve the growing seasons, loading every crop calendar only once
+            for name in (CROP_NAMES if crop == "aggr" else [crop]):
+                if name not in season_firr_dict:
+                    season_firr_dict[name] = load_calendar(repo_path, name, "firr")
+                    season_noirr_dict[name] = load_calendar(repo_path, name, "noirr")
+            cropdat = load_cropdat_aggr(repo_path) if crop == "aggr" else load_cropdat(repo_path, crop)
+            if union:
+                table = season_table(cropdat, *union_season(season_firr_dict, season_noirr_dict, cropdat, CROP_NAMES))
+            else:
+                table = season_table(cropdat, *growing_season(cropdat, season_firr_dict, season_noirr_dict, crop))
+            save_cached(table, path, key)
+
+        cells = pd.DataFrame({"lat": table["lat"].values, "lon": table["lon"].values})
+        day_mask = table["day_mask"].values.astype(bool) if "day_mask" in table else None
+        seasons[crop] = (cells, table["start_day"].values.astype(float), table["end_day"].values.astype(float), day_mask)
+    return seasons
+
+
+def threshold_cache(repo_path, variable, crop, percentile, union=False):
+    # Cache file and fingerprint of the thresholds of one percentile of a climate variable for a crop (or "aggr", union
+    # for the union season, see load_seasons): they depend on the climate data, the crop data and the crop calendars
+    path = cache_path(repo_path, f"thresholds_{variable}_{crop}{'_union' if union else ''}_q{percentile:g}")
+    key = fingerprint(repo_path, climate_files(repo_path, variable) + season_inputs(repo_path, crop), variable=variable, percentile=percentile)
+    return path, key
+
+
+def load_thresholds(repo_path, family, seasons, percentiles=None):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - family: "hot" or "drywet"
+    # - seasons: dictionary {crop: (cells, start_day, end_day, day_mask)} (see load_seasons)
+    # - percentiles: optional dictionary {frequency indicator: percentile}
+    # OUTPUT:
+    # - dictionary {crop: numpy array (extreme, cell)} with the cached thresholds (NaN if not cached or outdated)
+    # - list of (crop, extreme number) of the thresholds that are not cached
+
+    spec = indicator_spec(family, percentiles)
+    thresholds, missing = {}, []
+    for crop, (cells, _, _, day_mask) in seasons.items():
+        thresholds[crop] = np.full((len(spec["extremes"]), len(cells)), np.nan)
+        for k, (_, _, q, _) in enumerate(spec["extremes"]):
+            cached = load_cached(*threshold_cache(repo_path, spec["variable"], crop, q, day_mask is not None))
+            if cached is None:
+                missing.append((crop, k))
+            else:
+                thresholds[crop][k] = cached["threshold"].values
+    return thresholds, missing
+
+
+def save_thresholds(thresholds, repo_path, family, seasons, missing, percentiles=None):
+    # Save the computed thresholds of the (crop, extreme number) pairs in missing in the cache (see load_thresholds)
+    spec = indicator_spec(family, percentiles)
+    for crop, k in missing:
+        cells, _, _, day_mask = seasons[crop]
+        q = spec["extremes"][k][2]
+        table = xr.Dataset(
+            {"threshold": ("cell", thresholds[crop][k])},
+            coords={"lat": ("cell", cells["lat"].values), "lon": ("cell", cells["lon"].values)},
+            attrs={"variable": spec["variable"], "crop": crop, "percentile": q}
+        )
+        save_cached(table, *threshold_cache(repo_path, spec["variable"], crop, q, day_mask is not None))
+
+
+def compute_indicators(climate, seasons, family, percentiles=None, tile_rows=5, workers=1, thresholds=None, layout="grid",
+                       years=None, profile=None, checkpoint=None, resume=False, backend="numpy"):
+    # INPUT:
+    # - climate: xarray dataset with the daily climate variable of the family, list of decade datasets or
+    #   cellcache.CellCache
+    # - seasons: dictionary {crop: (cropdat, start_day, end_day, day_mask)} (see load_seasons)
+    # - family: "hot" or "drywet"
+    # - percentiles: optional dictionary {frequency indicator: percentile or list of percentiles} (see
+    #   engine.indicator_spec)
+    # - tile_rows: number of latitude rows of the climate grid processed at once
+    # - workers: number of processes that compute latitude bands in parallel
+    # - thresholds: optional dictionary {crop: numpy array (extreme, cell)} with known thresholds (NaN where unknown,
+    #   see engine.season_thresholds). It is completed in place with the computed thresholds of every crop.
+    # - layout: "grid" for dense (year, lat, lon) data arrays (zero outside the crop's grid cells) or "cells" for
+    #   sparse (year, cell) data arrays with the lat and lon of every grid cell of the crop (see grid.to_cells)
+    # - years: optional (first year, last year) of the climate data to use (None for no limit, see reader.year_slice)
+    # - profile: optional profiling.Profile that records the stage times and prints the progress (a new one if None)
+    # - checkpoint: optional folder where every completed latitude band is saved (see checkpoint.py)
+    # - resume: load the bands saved in the checkpoint folder by an earlier run with the same inputs instead of
+    #   computing them again
+    # - backend: "numpy" for the vectorized engine.season_stat or "numba" for the compiled one-pass kernel (see
+    #   kernel.py, the numpy engine is used if numba is not installed)
+    # OUTPUT:
+    # - dictionary {crop: {indicator: xarray data array (year, lat, lon) or (year, cell)}}, with a leading threshold
+    #   dimension (its percentiles as coordinate) for the indicators of a sweep
+
+    if layout not in ("grid", "cells"):
+        raise ValueError(f"Unknown layout {layout!r}, use 'grid' or 'cells'")
+    backend = available_backend(backend)
+
+    # Grid cells of all crops together, and the position of every crop's grid cells among them
+    coords = [cropdat[["lat", "lon"]] for cropdat, _, _, _ in seasons.values()]
+    cells = pd.MultiIndex.from_frame(pd.concat(coords).drop_duplicates())
+    cell_index = np.concatenate([cells.get_indexer(pd.MultiIndex.from_frame(coord)) for coord in coords])
+    start_day = np.concatenate([start for _, start, _, _ in seasons.values()])
+    end_day = np.concatenate([end for _, _, end, _ in seasons.values()])
+    # Growing season days of year of all seasons if a crop has a union season (see load_seasons)
+    day_mask = None
+    if any(mask is not None for _, _, _, mask in seasons.values()):
+        day_mask = np.concatenate([season_days(start, end) if mask is None else mask for _, start, end, mask in seasons.values()])
+    lats = cells.get_level_values("lat").values
+    lons = cells.get_level_values("lon").values
+    if thresholds is None:
+        thresholds = {}
+    n_extremes = len(indicator_spec(family, percentiles)["extremes"])
+    known = np.concatenate([thresholds.get(crop, np.full((n_extremes, len(cropdat)), np.nan)) for crop, (cropdat, _, _, _) in seasons.items()], axis=1)
+
+    variable = indicator_spec(family)["variable"]
+    if isinstance(climate, CellCache):
+        time = TimeIndex(climate.time(years))
+        bands = climate.bands(lats, tile_rows)
+        sources = climate
+        files = climate.files
+    else:
+        decades = as_decades(climate)
+        time = TimeIndex(climate_time(decades, years))
+        bands = latitude_bands(decades, lats, tile_rows)
+        sources = climate_sources(decades) if workers > 1 else decades
+        files = climate_sources(decades)
+    if len(time) == 0:
+        raise ValueError(f"No climate data in the years {years}")
+
+    # Compute the seasons of one latitude band at a time (in parallel if workers > 1)
+    tasks, columns = [], []
+    for band in bands:
+        in_band = np.flatnonzero(np.isin(cell_index, band))
+        band_index = np.searchsorted(band, cell_index[in_band])
+        tasks.append((sources, variable, lats[band], lons[band], time, start_day[in_band], end_day[in_band], family, percentiles,
+                      band_index, known[:, in_band], years, backend, None if day_mask is None else day_mask[in_band]))
+        columns.append(in_band)
+
+    if profile is None:
+        profile = Profile()
+    profile.start_task(f"{family} ({', '.join(seasons)})", len(lats))
+    # Bands saved by an earlier run that was stopped are not computed again
+    saved = {}
+    if checkpoint is not None:
+        keys = [band_key((files, *task[1:])) for task in tasks]
+        if resume:
+            saved = {number: load_band(band_path(checkpoint, family, number), keys[number]) for number in range(len(tasks))}
+            saved = {number: (*band, {}) for number, band in saved.items() if band is not None}
+    pending = [number for number in range(len(tasks)) if number not in saved]
+    computed = ((pending[i], band) for i, band in map_bands([tasks[number] for number in pending], workers))
+
+    stats = {}
+    for number, (years, band_stats, band_thresholds, stages) in chain(saved.items(), computed):
+        if checkpoint is not None and number not in saved:
+            save_band(band_path(checkpoint, family, number), keys[number], years, band_stats, band_thresholds)
+        for name, stat in band_stats.items():
+            stats.setdefault(name, np.zeros((*stat.shape[:-1], len(start_day))))[..., columns[number]] = stat
+        known[:, columns[number]] = band_thresholds
+        profile.progress(len(tasks[number][2]), stages)
+
+    # Split the seasons again per crop
+    regrid = to_cells if layout == "cells" else to_grid
+    levels = sweep_levels(indicator_spec(family, percentiles))
+    indicators = {}
+    offset = 0
+    for crop, (cropdat, _, _, _) in seasons.items():
+        columns = slice(offset, offset + len(cropdat))
+        indicators[crop] = {name: regrid(stat[..., columns], years, cropdat["lat"], cropdat["lon"], levels.get(name))
+                            for name, stat in stats.items()}
+        thresholds[crop] = known[:, columns]
+        offset += len(cropdat)
+    return indicators
+
+
+def climate_cache(repo_path, variable, tile_rows=5):
+    # Cell-major cache of a climate variable (see cellcache.py) over the grid cells of all crops, so that it serves the
+    # runs of any crop, of the crop aggregate and of any region
+    cells = pd.concat([cells for cells, _, _, _ in load_seasons(repo_path, CROP_NAMES).values()])
+    return load_cell_cache(repo_path, variable, cells["lat"].values, cells["lon"].values, tile_rows)
+
+
+def run_all(repo_path, families=("hot", "drywet"), crops=(*CROP_NAMES, "aggr"), percentiles=None, tile_rows=5, workers=1,
+            use_cache=True, layout="grid", thresholds=None, years=None, region=None, profile=None, checkpoint=None,
+            resume=False, cell_cache=False, backend="numpy", aggr_union=False):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - families: indicator families to compute
+    # - crops: crop names for the crop specific indicators and/or "aggr" for the crop aggregated indicators
+    # - percentiles: optional dictionary {frequency indicator: percentile or list of percentiles} (see
+    #   compute_indicators)
+    # - tile_rows: number of latitude rows of the climate grid processed at once
+    # - workers: number of processes that compute latitude bands in parallel
+    # - use_cache: reuse the growing season tables and percentile thresholds saved by earlier runs
+    #   (recomputed when an input file changed)
+    # - layout: "grid" (year, lat, lon) or "cells" (year, cell), see compute_indicators
+    # - thresholds: optional empty dictionary, filled with the thresholds {crop: {frequency indicator: numpy array (cell)}}
+    #   ((threshold, cell) for a sweep)
+    # - years: optional (first year, last year) of the climate data to use. The thresholds are then percentiles of these
+    #   years only (the threshold cache holds the ones of the full record and is not used).
+    # - region: optional function that selects the grid cells to compute (see region.make_region)
+    # - profile: optional profiling.Profile (see compute_indicators), e.g. Profile(enabled=False) to print nothing
+    # - checkpoint, resume: optional folder to save the completed latitude bands in, and whether to reuse the bands saved
+    #   there by an earlier run that was stopped (see compute_indicators)
+    # - cell_cache: read the climate data from the memory-mapped cell-major cache (see cellcache.py), converted first if
+    #   it does not exist yet or the climate files changed
+    # - backend: "numpy" or "numba" (see compute_indicators)
+    # - aggr_union: compute "aggr" over the exact union of the seasons of all crops (see load_seasons)
+    # OUTPUT:
+    # - dictionary {crop: {indicator: xarray data array}} with the indicators of all families
+
+    if profile is None:
+        profile = Profile()
+    with profile.stage("seasons"):
+        seasons = load_seasons(repo_path, list(crops), use_cache, aggr_union)
+    keep = {crop: region(cells) for crop, (cells, _, _, _) in seasons.items()} if region is not None else None
+    # The cached thresholds are the ones of the full record for all grid cells of a crop
+    cached_thresholds = use_cache and years is None
+
+    indicators = {crop: {} for crop in crops}
+    for family in families:
+        # percentiles may hold the ones of all families
+        family_q = family_percentiles(family, percentiles)
+        spec = indicator_spec(family, family_q)
+        if cell_cache:
+            with profile.stage("cell_cache"):
+                climate = climate_cache(repo_path, spec["variable"], tile_rows)
+        else:
+            climate = open_climate(repo_path, spec["variable"])
+        known, missing = load_thresholds(repo_path, family, seasons, family_q) if cached_thresholds else ({}, [])
+        if keep is None:
+            family_indicators = compute_indicators(climate, seasons, family, family_q, tile_rows, workers, known, layout, years,
+                                                   profile, checkpoint, resume, backend)
+            if cached_thresholds:
+                save_thresholds(known, repo_path, family, seasons, missing, family_q)
+        else:
+            # Only the grid cells of the region (the cache is only read, it holds the thresholds of all grid cells)
+            known = {crop: known[crop][:, keep[crop]] for crop in known}
+            family_indicators = compute_indicators(climate, select_cells(seasons, keep), family, family_q, tile_rows, workers,
+                                                   known, layout, years, profile, checkpoint, resume, backend)
+        for crop in crops:
+            indicators[crop].update(family_indicators[crop])
+            if thresholds is not None:
+                crop_thresholds = {}
+                for k, extreme in enumerate(spec["extremes"]):
+                    crop_thresholds.setdefault(extreme[0], []).append(known[crop][k])
+                thresholds.setdefault(crop, {}).update({frequency: np.array(values) if frequency in spec.get("sweep", {}) else values[0]
+                                                        for frequency, values in crop_thresholds.items()})
+    return indicators
+
+
+def run_indicators(repo_path, family, crop, percentiles=None, tile_rows=5, workers=1, use_cache=True, layout="grid",
+                   profile=None):
+    # Indicators of one family for one crop (or "aggr"): dictionary {indicator: xarray data array}
+    return run_all(repo_path, [family], [crop], percentiles, tile_rows, workers, use_cache, layout, profile=profile)[crop]
+
+
+def save_indicators(indicators, repo_path, crop, output_dir=None):
+    # Save every indicator as its own netcdf file (see data.output_path). The files always hold the dense
+    # (year, lat, lon) grid read by the analysis, indicators in the cell layout are regridded first. The indicators of
+    # a sweep keep their threshold dimension and are saved under their own name.
+    for name, indicator in indicators.items():
+        if "cell" in indicator.dims:
+            indicator = cells_to_grid(indicator)
+        path = output_path(repo_path, name, crop, output_dir, "threshold" in indicator.dims)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        indicator.to_netcdf(path)
+
+
+def save_indicator_store(indicators, repo_path, thresholds=None, percentiles=None, region=None, output_dir=None,
+                         aggr_union=False):
+    # Save the indicators of all crops in one netcdf4 file (see store.py and data.store_path), with the thresholds
+    # (see run_all) needed to extend it later with update_store. region, aggr_union: the ones of run_all.
+    # The store holds one threshold per indicator, the indicators of a sweep are only saved as files (save_indicators).
+    if any(np.ndim(q) for q in (percentiles or {}).values()):
+        raise ValueError("The indicators of a percentile sweep are saved as files only, not in the store")
+    seasons = load_seasons(repo_path, list(indicators), aggr_union=aggr_union)
+    if region is not None:
+        seasons = select_cells(seasons, {crop: region(cells) for crop, (cells, _, _, _) in seasons.items()})
+    save_store(to_store(indicators, seasons, thresholds, percentiles), store_path(repo_path, output_dir))
+
+
+def update_store(repo_path, tile_rows=5, workers=1, profile=None, backend="numpy"):
+    # INPUT:
+    # - repo_path: base path of the repository
+    # - tile_rows, workers, profile, backend: see compute_indicators
+    # OUTPUT:
+    # - years of the store that were computed again (empty if the climate data has no year after the store)
+
+    # Incremental mode for new climate data releases: the store (see save_indicator_store) is extended with the years
+    # of the climate data after its last year, instead of computing the full record again. The thresholds are not
+    # computed again: the ones saved in the store (from the record it was computed with) are kept.
+    # Only the season years from the last year of the store on are computed. The last year is included because its
+    # seasons spanning two calendar years are set to 0 as long as it is the last year of the record; the year before
+    # it is read as well for the days of these seasons before the turn of the year.
+
+    path = store_path(repo_path)
+    with xr.open_dataset(path, engine="netcdf4") as store:
+        store = store.load()
+    crops = [str(crop) for crop in store["crop"].values]
+    last_year = int(store["year"].max())
+    stored = pd.MultiIndex.from_arrays([store["lat"].values, store["lon"].values])
+
+    # Families in the store and their climate data
+    families = {}
+    for family, spec in INDICATORS.items():
+        if all(f"{extreme[0]}_threshold" in store for extreme in spec["extremes"]):
+            families[family] = open_climate(repo_path, spec["variable"])
+    end_year = min(pd.DatetimeIndex(climate_time(as_decades(climate))).year.max() for climate in families.values())
+    if end_year <= last_year:
+        return []
+
+    if profile is None:
+        profile = Profile()
+    with profile.stage("seasons"):
+        # with the merged season of "aggr" the store was computed with (see store.to_store)
+        seasons = load_seasons(repo_path, crops, aggr_union=store.attrs.get("aggr_season") == "union")
+    indicators = {crop: {} for crop in crops}
+    thresholds = {crop: {} for crop in crops}
+    percentiles = {}
+    for family, climate in families.items():
+        frequencies = [extreme[0] for extreme in INDICATORS[family]["extremes"]]
+        family_percentiles = {frequency: float(store[f"{frequency}_threshold"].attrs["percentile"]) for frequency in frequencies}
+        percentiles.update(family_percentiles)
+
+        # Stored thresholds at the grid cells of every crop
+        known = {}
+        for i, (crop, (cells, _, _, _)) in enumerate(seasons.items()):
+            columns = stored.get_indexer(pd.MultiIndex.from_frame(cells[["lat", "lon"]]))
+            if (columns < 0).any():
+                raise ValueError(f"The grid cells of {crop} changed since {path.name} was written, compute it again with run_all")
+            known[crop] = np.array([store[f"{frequency}_threshold"].values[i, columns] for frequency in frequencies])
+            thresholds[crop].update({frequency: known[crop][k] for k, frequency in enumerate(frequencies)})
+
+        family_indicators = compute_indicators(climate, seasons, family, family_percentiles, tile_rows, workers, known,
+                                               layout="cells", years=(last_year - 1, end_year), profile=profile, backend=backend)
+        for crop in crops:
+            indicators[crop].update(family_indicators[crop])
+
+    # Replace the season years from the last year of the store on
+    new = to_store(indicators, seasons, thresholds, percentiles)
+    years = new["year"].values[new["year"].values >= last_year]
+    updated = xr.concat([store.sel(year=store["year"] < last_year), new.sel(year=years)], dim="year",
+                        data_vars="minimal", coords="minimal", compat="override")
+    with profile.stage("write"):
+        save_store(updated, path)
+    return [int(year) for year in years]
@@ -0,0 +1,44 @@
+## LONGEST RUN OF EXTREME DAYS
+
+# Vectorized replacement of the extreme_length loop of the original scripts. Instead of walking through one
+# series at a time, the run lengths of all series are derived from cumulative sums along the time axis:
+# at every day the current run is the number of extreme days so far minus that number at the last non-extreme day.
+
+import numpy as np
+
+
+def run_lengths(binary, axis=0, carry=None):
+    # INPUT:
+    # - binary: boolean numpy array (any number of dimensions) with the extreme days
+    # - axis: time axis of binary
+    # - carry: optional run length that is already ongoing before the first day, for every series
+    #          (shape of binary without the time axis). Used to join a season that is split over two arrays.
+    # OUTPUT:
+    # - numpy array with the length of the run ending at every day (same shape as binary)
+
+    binary = np.moveaxis(np.asarray(binary, dtype=bool), axis, 0)
+    ones = np.cumsum(binary, axis=0, dtype=np.int32)
+    # number of extreme days up to the last non-extreme day (0 if there was none yet)
+    ones_at_break = np.maximum.accumulate(np.where(binary, 0, ones), axis=0)
+    runs = ones - ones_at_break
+    if carry is not None:
+        # the carried run continues as long as no non-extreme day has been seen
+        unbroken = np.logical_and.accumulate(binary, axis=0)
+        runs = runs + unbroken * np.asarray(carry, dtype=np.int32)
+    return np.moveaxis(runs, 0, axis)
+
+
+def longest_run(binary, axis=0, carry=None):
+    # INPUT:
+    # - binary: boolean numpy array with the extreme days (2-D (time, cell), 3-D (time, lat, lon), ...)
+    # - axis: time axis of binary
+    # - carry: optional run length that is already ongoing before the first day (see run_lengths)
+    # OUTPUT:
+    # - longest: maximum length of consecutive extreme days for every series
+    # - trailing: length of the run that is still ongoing at the last day, to be carried into the next part of a season
+
+    runs = np.moveaxis(run_lengths(binary, axis=axis, carry=carry), axis, 0)
+    if runs.shape[0] == 0:
+        carried = np.zeros(runs.shape[1:], dtype=np.int32) if carry is None else np.asarray(carry, dtype=np.int32)
+        return carried, carried
+    return runs.max(axis=0), runs[-1]
@@ -0,0 +1,181 @@
+## GROWING SEASON RESOLUTION
+
+# Turns the ISIMIP crop calendars (planting_day and maturity_day of the firr and noirr runs) and the land use
+# information of every grid cell into one effective start and end day per grid cell. All grid cells are resolved
+# at once with array operations instead of one .sel() per cell.
+
+import numpy as np
+import xarray as xr
+
+from .engine import season_days
+
+
+def _first_min(a, b):
+    # Element-wise equivalent of Python's min(a, b) as used in the original per-cell loop:
+    # b is only taken if it is strictly smaller, so a NaN in a is kept and a NaN in b is ignored
+    return np.where(b < a, b, a)
+
+
+def _first_max(a, b):
+    # Element-wise equivalent of Python's max(a, b) (see _first_min)
+    return np.where(b > a, b, a)
+
+
+def calendar_at(season, lats, lons):
+    # INPUT:
+    # - season: crop calendar xarray dataset with planting_day and maturity_day
+    # - lats, lons: coordinates of the grid cells
+    # OUTPUT:
+    # - planting and maturity day for every grid cell (numpy float arrays)
+
+    cells = dict(lat=xr.DataArray(np.asarray(lats), dims="cell"), lon=xr.DataArray(np.asarray(lons), dims="cell"))
+    start = season["planting_day"].sel(**cells).values.astype(float)
+    end = season["maturity_day"].sel(**cells).values.astype(float)
+    return start, end
+
+
+def crop_season(season_firr, season_noirr, cropdat):
+    # INPUT:
+    # - season_firr: full irrigation crop calendar xarray dataset
+    # - season_noirr: rainfed crop calendar xarray dataset
+    # - cropdat: dataframe with one row per grid cell and the rain_area and irr_area columns
+    # OUTPUT:
+    # - start and end day of the growing season for every row of cropdat (NaN if the cell has no crop area)
+
+    # Integrate firr and noirr in three cases using the land use data: if only rainfed, we pick the noirr, if only irr,
+    # we pick the firr growing season and if it is a combination of the two we extend the growing season such that
+    # it covers both (so all days where either irrigated or rainfed crops are grown)
+    start_firr, end_firr = calendar_at(season_firr, cropdat["lat"], cropdat["lon"])
+    start_noirr, end_noirr = calendar_at(season_noirr, cropdat["lat"], cropdat["lon"])
+    rain_area = cropdat["rain_area"].values
+    irr_area = cropdat["irr_area"].values
+
+    rainfed = (rain_area > 0) & (irr_area == 0)
+    irrigated = (irr_area > 0) & (rain_area == 0)
+    both = (rain_area > 0) & (irr_area > 0)
+
+    start = np.full(len(cropdat), np.nan)
+    end = np.full(len(cropdat), np.nan)
+    start[rainfed], end[rainfed] = start_noirr[rainfed], end_noirr[rainfed]
+    start[irrigated], end[irrigated] = start_firr[irrigated], end_firr[irrigated]
+    start[both] = _first_min(start_firr, start_noirr)[both]
+    end[both] = _first_max(end_firr, end_noirr)[both]
+    return start, end
+
+
+def aggr_season(season_firr_dict, season_noirr_dict, cropdat, crop_names):
+    # INPUT:
+    # - season_firr_dict: dictionary of full irrigation crop calendar xarray datasets
+    # - season_noirr_dict: dictionary of rainfed crop calendar xarray datasets
+    # - cropdat: dataframe with one row per grid cell and rain_area_<crop> and irr_area_<crop> columns
+    # - crop_names: crops in the order in which they are merged
+    # OUTPUT:
+    # - start and end day of the merged growing season for every row of cropdat (NaN if no crop is grown)
+
+    # The crops are merged in the same order and with the same update rule as the original per-cell loop,
+    # so that the merged season is identical for every grid cell
+    n_cells = len(cropdat)
+    start_loc = np.full(n_cells, np.inf)
+    end_loc = np.full(n_cells, -np.inf)
+    start_crop = np.full(n_cells, np.inf)
+    end_crop = np.full(n_cells, -np.inf)
+
+    for crop in crop_names:
+        rain_area = cropdat[f"rain_area_{crop}"].values
+        irr_area = cropdat[f"irr_area_{crop}"].values
+        start_firr, end_firr = calendar_at(season_firr_dict[crop], cropdat["lat"], cropdat["lon"])
+        start_noirr, end_noirr = calendar_at(season_noirr_dict[crop], cropdat["lat"], cropdat["lon"])
+
+        present = ~((rain_area == 0) & (irr_area == 0))
+        rainfed = (rain_area > 0) & (irr_area == 0)
+        irrigated = (irr_area > 0) & (rain_area == 0)
+        both = (rain_area > 0) & (irr_area > 0)
+
+        start_loc = np.where(rainfed, start_noirr, np.where(irrigated, start_firr, start_loc))
+        end_loc = np.where(rainfed, end_noirr, np.where(irrigated, end_firr, end_loc))
+        start_crop = np.where(both, _first_min(start_firr, start_noirr), start_crop)
+        end_crop = np.where(both, _first_max(end_firr, end_noirr), end_crop)
+
+        start_loc = np.where(present, _first_min(start_loc, start_crop), start_loc)
+        end_loc = np.where(present, _first_max(end_loc, end_crop), end_loc)
+
+    # Cells without any crop keep the infinite initial values: mark them as having no season
+    no_season = ~np.isfinite(start_loc) | ~np.isfinite(end_loc)
+    start_loc[no_season] = np.nan
+    end_loc[no_season] = np.nan
+    return start_loc, end_loc
+
+
+def union_bounds(day_mask):
+    # INPUT:
+    # - day_mask: boolean numpy array (cell, 366) with the growing season days of year of every grid cell
+    # OUTPUT:
+    # - start and end day of the interval that covers all days of the mask: the first and last day of the mask, or if
+    #   the mask crosses the turn of the year (has day 1 and day 365), the days between its longest gap (of a 365-day
+    #   year). 1 and 365 for masks without a gap, NaN for empty masks.
+
+    n_cells = len(day_mask)
+    # Two years after each other, so gaps across the turn of the year are one run
+    twice = np.concatenate([day_mask[:, :365], day_mask[:, :365]], axis=1)
+    position = np.arange(730)
+    last_season_day = np.maximum.accumulate(np.where(twice, position, -1), axis=1)
+    # Length of the gap that ends on every day of the second year, and the longest one
+    gap = position[365:] - last_season_day[:, 365:]
+    gap_end = 365 + np.argmax(gap, axis=1)
+    gap_length = gap[np.arange(n_cells), gap_end - 365]
+
+    start = ((gap_end + 1) % 365 + 1).astype(float)
+    end = ((gap_end - gap_length) % 365 + 1).astype(float)
+    # Masks within the calendar year keep their season years: from their first to their last day
+    within = ~(day_mask[:, 0] & day_mask[:, 364])
+    start[within] = np.argmax(day_mask[within, :365], axis=1) + 1
+    end[within] = 365 - np.argmax(day_mask[within, 364::-1], axis=1)
+    full = day_mask[:, :365].all(axis=1)
+    start[full], end[full] = 1, 365
+    empty = ~day_mask.any(axis=1)
+    start[empty], end[empty] = np.nan, np.nan
+    return start, end
+
+
+def union_season(season_firr_dict, season_noirr_dict, cropdat, crop_names):
+    # INPUT:
+    # - season_firr_dict, season_noirr_dict, cropdat, crop_names: as in aggr_season
+    # OUTPUT:
+    # - start and end day of the merged growing season for every row of cropdat (see union_bounds, NaN if no crop is
+    #   grown), which set the season year of its days
+    # - boolean numpy array (cell, 366) with the days of year of the merged growing season of every row of cropdat
+
+    # Alternative to aggr_season, which extends the season to the earliest start and latest end of all crops. Here the
+    # merged season is exactly the union of the seasons of every crop and irrigation system grown in the grid cell
+    # (the noirr season where the crop has rainfed area, the firr season where it has irrigated area): the days between
+    # disjoint seasons are left out and seasons spanning two calendar years are merged across the turn of the year.
+    day_mask = np.zeros((len(cropdat), 366), dtype=bool)
+    for crop in crop_names:
+        for calendar, area in ((season_noirr_dict[crop], "rain_area"), (season_firr_dict[crop], "irr_area")):
+            grown = cropdat[f"{area}_{crop}"].values > 0
+            day_mask |= season_days(*calendar_at(calendar, cropdat["lat"], cropdat["lon"])) & grown[:, None]
+    return (*union_bounds(day_mask), day_mask)
+
+
+def season_table(cropdat, start_day, end_day, day_mask=None):
+    # INPUT:
+    # - cropdat: dataframe with one row per grid cell
+    # - start_day, end_day: growing season of every row of cropdat
+    # - day_mask: optional growing season days of year of every row of cropdat (see aggr_union)
+    # OUTPUT:
+    # - compact xarray dataset (cell) with lat, lon, start_day, end_day and wraps (season spans two calendar years),
+    #   and day_mask (cell, dayofyear) if given. Days are whole numbers, so storing them as float32 (NaN for no season)
+    #   is exact.
+
+    table = xr.Dataset(
+        {
+            "start_day": ("cell", np.asarray(start_day, dtype=np.float32)),
+            "end_day": ("cell", np.asarray(end_day, dtype=np.float32)),
+            "wraps": ("cell", np.asarray(end_day) < np.asarray(start_day)),
+        },
+        coords={"lat": ("cell", np.asarray(cropdat["lat"], dtype=float)), "lon": ("cell", np.asarray(cropdat["lon"], dtype=float))}
+    )
+    if day_mask is not None:
+        table["day_mask"] = (("cell", "dayofyear"), np.asarray(day_mask, dtype=bool))
+        table = table.assign_coords(dayofyear=np.arange(1, 367))
+    return table
@@ -0,0 +1,153 @@
+## SINGLE OUTPUT STORE OF ALL INDICATORS
+
+# Alternative to the one netcdf file per indicator and crop (see data.output_path): all indicators of all crops and of
+# the crop aggregate are written to one chunked and compressed netcdf4 file with a crop dimension, so that the analysis
+# opens one file instead of dozens.
+
+# The store uses the sparse cell layout (see grid.py): a cell dimension over the cropland grid cells of all crops
+# together, with lat and lon coordinate variables along it. Its size grows with the number of cropland grid cells
+# instead of the bounding grid.
+
+# Layout (dimensions crop, year, cell):
+# - <frequency>_days (e.g. FHD_days): int16 number of extreme days per growing season
+# - <spell> (e.g. LHS): int16 longest spell of extreme days
+# - TPR: float32 total growing season precipitation
+# - season_length (crop, cell): int16 nominal growing season length (0 where the crop has no season)
+# - <frequency>_threshold (crop, cell): threshold of the extreme days (percentile of the growing season days of the
+#   record, in the "percentile" attribute), kept to extend the store with new years (see run.update_store)
+# - aggr_season attribute: "hull" or "union", the merged growing season of the crop aggregate (see run.load_seasons)
+# The frequency indicators are <frequency>_days / season_length (0 where season_length is 0): storing the counts keeps
+# them exact with a compact dtype. Grid cells where a crop is not grown are missing (-1 or NaN fill values), so they
+# can be told apart from grid cells without extreme days.
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .engine import INDICATORS, season_length
+from .grid import cells_to_grid, to_cells
+
+ENCODING = {"zlib": True, "complevel": 4, "shuffle": True}
+
+# Number of grid cells per chunk (all years of a grid cell are in the same chunk)
+CELL_CHUNK = 4096
+
+
+def _indicator_names():
+    # Frequency, spell and total indicator names of all families
+    frequencies = [extreme[0] for spec in INDICATORS.values() for extreme in spec["extremes"]]
+    spells = [extreme[1] for spec in INDICATORS.values() for extreme in spec["extremes"]]
+    totals = [spec["total"] for spec in INDICATORS.values() if spec["total"]]
+    return frequencies, spells, totals
+
+
+def _at_cells(indicator, cells):
+    # Values (year, cell) of an indicator in the grid or the cell layout at the grid cells of a crop
+    if "cell" in indicator.dims:
+        return indicator.values
+    points = dict(lat=xr.DataArray(cells["lat"].values, dims="cell"), lon=xr.DataArray(cells["lon"].values, dims="cell"))
+    return indicator.sel(**points).transpose("year", "cell").values
+
+
+def to_store(indicators, seasons, thresholds=None, percentiles=None):
+    # INPUT:
+    # - indicators: dictionary {crop: {indicator: xarray data array}} in the grid or the cell layout (see run.run_all)
+    # - seasons: dictionary {crop: (cells, start_day, end_day, day_mask)} of the same crops (see run.load_seasons)
+    # - thresholds: optional dictionary {crop: {frequency indicator: numpy array (cell)}} (see run.run_all)
+    # - percentiles: optional dictionary {frequency indicator: percentile} the thresholds were computed with
+    # OUTPUT:
+    # - xarray dataset (crop, year, cell) in the layout described above
+
+    frequencies, _, _ = _indicator_names()
+    crops = list(indicators)
+    years = next(iter(indicators[crops[0]].values()))["year"].values
+
+    # Grid cells of all crops, ordered by latitude and longitude, and the position of every crop's grid cells among them
+    all_cells = pd.concat([seasons[crop][0][["lat", "lon"]] for crop in crops]).drop_duplicates().sort_values(["lat", "lon"])
+    cell_index = pd.MultiIndex.from_frame(all_cells)
+    columns = {crop: cell_index.get_indexer(pd.MultiIndex.from_frame(seasons[crop][0][["lat", "lon"]])) for crop in crops}
+
+    def stack(values):
+        # Crop dimension over the grid cells of all crops, NaN where a crop is not grown
+        stacked = np.full((len(crops), *values[crops[0]].shape[:-1], len(cell_index)), np.nan)
+        for i, crop in enumerate(crops):
+            stacked[i, ..., columns[crop]] = np.moveaxis(values[crop], -1, 0)
+        return stacked
+
+    lengths = {}
+    for crop in crops:
+        _, start_day, end_day, day_mask = seasons[crop]
+        lengths[crop] = np.where(np.isnan(start_day) | np.isnan(end_day), 0, season_length(start_day, end_day, day_mask))
+
+    store = xr.Dataset(
+        {"season_length": (("crop", "cell"), stack(lengths))},
+        coords={"crop": crops, "year": years, "lat": ("cell", all_cells["lat"].values), "lon": ("cell", all_cells["lon"].values)}
+    )
+    if "aggr" in crops:
+        store.attrs["aggr_season"] = "hull" if seasons["aggr"][3] is None else "union"
+    for name in indicators[crops[0]]:
+        values = {crop: _at_cells(indicators[crop][name], seasons[crop][0]) for crop in crops}
+        if name in frequencies:
+            # Back from frequencies to whole numbers of days
+            values = {crop: np.rint(values[crop] * lengths[crop]) for crop in crops}
+            name = f"{name}_days"
+        store[name] = (("crop", "year", "cell"), stack(values))
+
+    if thresholds:
+        default = {extreme[0]: extreme[2] for spec in INDICATORS.values() for extreme in spec["extremes"]}
+        for frequency in thresholds[crops[0]]:
+            values = {crop: thresholds[crop][frequency] for crop in crops}
+            q = (percentiles or {}).get(frequency, default[frequency])
+            store[f"{frequency}_threshold"] = (("crop", "cell"), stack(values), {"percentile": q})
+    return store
+
+
+def save_store(store, path):
+    # Save a store dataset (see to_store) as one chunked and compressed netcdf4 file
+    _, _, totals = _indicator_names()
+    encoding = {}
+    for name, variable in store.data_vars.items():
+        if name.endswith("_threshold"):
+            encoding[name] = dict(ENCODING, dtype="float64", _FillValue=np.nan)
+        elif name in totals:
+            encoding[name] = dict(ENCODING, dtype="float32", _FillValue=np.float32(np.nan))
+        else:
+            encoding[name] = dict(ENCODING, dtype="int16", _FillValue=np.int16(-1))
+        # One chunk per crop and block of grid cells
+        encoding[name]["chunksizes"] = tuple(1 if dim == "crop" else (min(size, CELL_CHUNK) if dim == "cell" else size)
+                                             for dim, size in zip(variable.dims, variable.shape))
+    # the encoding of a store read from disk (see run.update_store) is replaced by the one above
+    store = store.copy()
+    for variable in store.variables.values():
+        variable.encoding = {}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    store.to_netcdf(path, engine="netcdf4", format="NETCDF4", encoding=encoding)
+
+
+def load_store(path, crop, layout="grid"):
+    # INPUT:
+    # - path: netcdf file written by save_store
+    # - crop: crop name or "aggr"
+    # - layout: "grid" for the dense (year, lat, lon) arrays of the per-indicator files (zero where the crop is not
+    #   grown) or "cells" for (year, cell) arrays over the grid cells of the crop
+    # OUTPUT:
+    # - dictionary {indicator: xarray data array} as computed by run.run_all (frequencies in float64)
+
+    frequencies, _, _ = _indicator_names()
+    with xr.open_dataset(path, engine="netcdf4") as store:
+        store = store.sel(crop=crop).load()
+    # Only the grid cells of the crop
+    store = store.isel(cell=np.flatnonzero(~np.isnan(store["season_length"].values)))
+    length = store["season_length"].values
+
+    indicators = {}
+    for name, variable in store.data_vars.items():
+        if name == "season_length" or name.endswith("_threshold"):
+            continue
+        values = variable.transpose("year", "cell").values.astype(float)
+        if name.endswith("_days") and name[:-len("_days")] in frequencies:
+            name = name[:-len("_days")]
+            values = np.where(length > 0, values / np.where(length > 0, length, 1), 0)
+        indicator = to_cells(values, store["year"].values, store["lat"].values, store["lon"].values)
+        indicators[name] = cells_to_grid(indicator) if layout == "grid" else indicator
+    return indicators
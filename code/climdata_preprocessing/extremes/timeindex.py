@@ -0,0 +1,54 @@
+## TIME INDEX OF THE DAILY RECORD
+
+# The calendar arithmetic of the time axis is the same for every grid cell, band and crop: it is done once per run
+# from the time stamps and the resulting integer arrays and slices are passed to the engine, instead of parsing the
+# dates and scanning them for every year again.
+
+import numpy as np
+import pandas as pd
+
+
+def days_in_year(years):
+    # 366 for leap years of the Gregorian calendar, 365 otherwise
+    years = np.asarray(years)
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    return np.where(leap, 366, 365)
+
+
+class TimeIndex:
+    # Calendar of a daily record (time stamps in increasing order):
+    # - time: time stamps (numpy datetime64)
+    # - dayofyear: day of year of every day
+    # - years: calendar years of the record
+    # - year_number: position of the year of every day in years
+    # - year_slices: slice of the days of every year of years
+
+    def __init__(self, time):
+        time = pd.DatetimeIndex(time)
+        if not time.is_monotonic_increasing:
+            raise ValueError("The time stamps of the climate data are not in increasing order")
+        self.time = time.values
+        self.dayofyear = time.dayofyear.values
+        self.years, first, self.year_number = np.unique(time.year.values, return_index=True, return_inverse=True)
+        bounds = np.append(first, len(time))
+        self.year_slices = [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def __len__(self):
+        return len(self.time)
+
+    def next_year(self, start_day, end_day, days=slice(None)):
+        # INPUT:
+        # - start_day, end_day: numpy arrays (cell) with the planting and maturity day of every grid cell
+        # - days: optional slice of the days (e.g. one of year_slices)
+        # OUTPUT:
+        # - boolean numpy array (day, cell), True for the days after planting of seasons spanning two calendar years:
+        #   they belong to the season year after their calendar year (labelled with the year in which the season ends)
+
+        return (end_day < start_day) & (self.dayofyear[days][:, None] >= start_day)
+
+
+def time_index(time):
+    # TimeIndex of time stamps (returned as is if time already is a TimeIndex)
+    if isinstance(time, TimeIndex):
+        return time
+    return TimeIndex(time)
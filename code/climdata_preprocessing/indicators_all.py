@@ -0,0 +1,113 @@
+## COMPUTATION OF ALL EXTREME CLIMATE INDICATORS IN ONE RUN
+
+# This script computes the hot (FHD, LHS) and dry/wet (FDD, FWD, TPR, LDS, LWS) climate extreme indicators
+# for every main crop (crop specific, appendix results) and for the union of all crops (crop aggregated, main results)
+# in a single run. It produces the same files as running the four indicators_*.py scripts for all crops, but the
+# tasmax and pr data are each read only once: the daily series of a grid cell is shared by all crops grown there.
+
+# Output: gridded climate extreme indicators saved to 
+# GGCMI-validation/data/processed/extremes_indicators/crop_specific/ and
+# GGCMI-validation/data/processed/extremes_indicators/crop_aggregated/
+# and/or all together in GGCMI-validation/data/processed/extremes_indicators/extremes_indicators.nc
+
+from pathlib import Path
+
+import xarray as xr
+
+from extremes.checkpoint import CHECKPOINT_DIR, clear_checkpoints
+from extremes.data import store_path
+from extremes.profiling import Profile
+from extremes.run import run_all, save_indicator_store, save_indicators, update_store
+from extremes.store import load_store
+
+# User-defined base path to the repository
+repo_path = Path("") #change accordingly!
+
+# Number of latitude rows of the climate grid processed at once: bounds the memory use
+# (e.g. 2 on a 16 GB workstation, 20 or more on a large HPC node)
+tile_rows = 5
+
+# Number of processes that compute latitude bands in parallel (every worker holds one band in memory)
+workers = 1
+
+# Percentile thresholds of the frequency indicators (None for the defaults: 0.95 for FHD and FWD, 0.05 for FDD), e.g.
+# {"FHD": 0.9}. A list of percentiles, e.g. {"FHD": [0.9, 0.95, 0.975, 0.99], "FDD": [0.01, 0.025, 0.05, 0.1]}, is a
+# sensitivity sweep: all thresholds are computed and evaluated in the same pass over the climate data and the
+# indicators get a threshold dimension. Sweeps are saved as files only (output = "files", as <name>_<crop>_sweep.nc)
+# and not in the lazy mode.
+percentiles = None
+
+# Growing season of the crop aggregate: False for the earliest planting to the latest maturity day of all crops (as
+# indicators_*_aggr.py), True for the exact union of the seasons of all crops and irrigation systems grown in a grid
+# cell (without the days between disjoint seasons, see extremes/seasons.py). Not available in the lazy mode; the update
+# mode keeps the season of the store.
+aggr_union = False
+
+# Engine of the growing season statistics: "numpy" (vectorized) or "numba" (compiled one-pass kernel per grid cell,
+# see extremes/kernel.py, requires numba: it avoids the temporary masks of the vectorized engine on large bands)
+backend = "numpy"
+
+# Opt-in dask mode (requires dask): the climate data is processed chunk by chunk (tile_rows latitude rows per chunk)
+# by the dask scheduler and the indicators are written to disk directly, without holding them in memory
+lazy = False
+
+# Output format: "files" (one netcdf file per indicator and crop), "store" (one compressed netcdf4 file with all
+# indicators of all crops, see extremes/store.py) or "both". The lazy mode always writes the files.
+output = "both"
+
+# Incremental mode for new climate data releases (e.g. GSWP3-W5E5 extended past 2019): only the years after the last
+# year of extremes_indicators.nc are computed and added to it (with the thresholds saved in it), instead of the full
+# record. Add the new decade files to the climate data folder and run with update = True (requires a previous run
+# with output = "store" or "both").
+update = False
+
+# Read the climate data from a cell-major copy of the cropland grid cells (see extremes/cellcache.py) instead of the
+# time-major netcdf files: converted once (a few GB per variable in extremes_indicators/cache), then memory-mapped by
+# every later run
+cell_cache = False
+
+# Checkpoints for long runs (e.g. on HPC queues with a wall-clock limit): with checkpoint = True every completed
+# latitude band is saved in extremes_indicators/cache/checkpoints. If the run is stopped, run again with resume = True
+# to compute only the remaining bands (same settings and input files). The saved bands are deleted at the end of the run.
+checkpoint = False
+resume = False
+
+# Progress (grid cells done, cells per second, time left, peak memory) and time per stage printed during the run,
+# optionally saved as a json file at the end (e.g. profile_json = "profile.json")
+progress = True
+profile_json = None
+
+## 1. Load the data and calculate the growing season statistics of all crops and the crop aggregate
+## 2. Save new datasets as netcdf files
+profile = Profile(enabled=progress)
+if update:
+    years = update_store(repo_path, tile_rows=tile_rows, workers=workers, profile=profile, backend=backend)
+    print(f"Computed the years {years}" if years else "No new years in the climate data")
+    if years and output in ("files", "both"):
+        with xr.open_dataset(store_path(repo_path)) as store:
+            crops = [str(crop) for crop in store["crop"].values]
+        with profile.stage("write"):
+            for crop in crops:
+                save_indicators(load_store(store_path(repo_path), crop), repo_path, crop)
+elif lazy:
+    from extremes.lazy import run_lazy
+    run_lazy(repo_path, percentiles=percentiles, lat_chunk=tile_rows, backend=backend)
+else:
+    # The indicators are kept in the sparse cell layout (cropland grid cells only) until they are saved
+    thresholds = {}
+    checkpoint_dir = repo_path / CHECKPOINT_DIR if checkpoint or resume else None
+    indicators = run_all(repo_path, percentiles=percentiles, tile_rows=tile_rows, workers=workers, layout="cells", thresholds=thresholds, profile=profile,
+                         checkpoint=checkpoint_dir, resume=resume, cell_cache=cell_cache, backend=backend,
+                         aggr_union=aggr_union)
+    with profile.stage("write"):
+        if output in ("files", "both"):
+            for crop, crop_indicators in indicators.items():
+                save_indicators(crop_indicators, repo_path, crop)
+        if output in ("store", "both"):
+            save_indicator_store(indicators, repo_path, thresholds, percentiles, aggr_union=aggr_union)
+    if checkpoint_dir is not None:
+        clear_checkpoints(checkpoint_dir)
+
+profile.report()
+if profile_json:
+    profile.dump(profile_json)
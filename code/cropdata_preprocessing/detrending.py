@@ -0,0 +1,132 @@
+## QUADRATIC DETRENDING OF YIELD PANELS
+
+# Python version of the detrending step of 03_integration_detrending.qmd. The notebook fits
+# lm(yield ~ poly(year, 2, raw = TRUE)) one group at a time (every grid cell for GDHY, every grid cell and model for
+# the simulations, per crop or for the crop aggregate). Here the yields of all groups are put in one (group, year)
+# matrix and all quadratic fits are solved at once with array operations, so a whole panel is detrended in seconds.
+# The fits use the orthogonal polynomials of the observed years of every group (three-term recurrence), which span the
+# same space as the raw polynomial and give the same fitted values as lm without its ill-conditioning (year^2 ~ 4e6).
+# The rows, the group filter and the detrended yields follow the notebook:
+# - rows with a missing value in any column are dropped (na.omit) and groups with fewer than 3 years are left out
+# - divtrend = yield / fitted (relative) and difftrend = yield - fitted (absolute), where the fitted values are
+#   pmax(.fitted, 0) in divtrend only for the crop specific yields, and pmax(.fitted, 1e-10) in both for the crop
+#   aggregate (floor, see detrend)
+# - rows with a zero yield are dropped and log_divtrend = log(divtrend) is added
+# Run from code/cropdata_preprocessing on a table in long format (one row per group and year), e.g.
+#   python detrending.py combined_sim.csv detr_sim.csv --value tot_yld --groups lon lat model --suffix sim
+#   python detrending.py combined_obs.csv detr_obs.csv --value yield --groups lon lat --suffix obs --distinct
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Fitted values below which the aggregate yields are not divided (pmax(.fitted, 0.0000000001) in the notebook)
+AGGR_FLOOR = 1e-10
+
+
+def _weighted_mean(a, weights, n):
+    # Mean over the years of every group of a numpy array (group, year), missing years with a weight of 0
+    return (a * weights).sum(axis=1, keepdims=True) / n
+
+
+def quadratic_fit(values, years, counts=None):
+    # INPUT:
+    # - values: numpy array (group, year) with the yields, NaN for the years without a value
+    # - years: numpy array (year) with the years of the columns
+    # - counts: optional numpy array (group, year) with the number of rows of every value, which is then their mean
+    #   (lm counts every row of a year as an observation, see detrend)
+    # OUTPUT:
+    # - numpy array (group, year) with the fitted values of the least squares fit of values ~ year + year^2 of every
+    #   group (as lm(values ~ poly(year, 2, raw = TRUE)), NaN for the years without a value. With fewer than 3 distinct
+    #   years the degree is lowered, as lm does with the coefficients it cannot estimate (NA).
+
+    values = np.asarray(values, dtype=float)
+    observed = ~np.isnan(values)
+    weights = observed.astype(float) if counts is None else np.where(observed, counts, 0).astype(float)
+    y = np.where(observed, values, 0)
+    n = weights.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Polynomials of degree 0, 1 and 2 that are orthogonal over the observed years of every group
+        x = np.asarray(years, dtype=float)[None, :] - _weighted_mean(np.asarray(years, dtype=float)[None, :], weights, n)
+        x = np.where(observed, x, 0)
+        fitted = np.broadcast_to(_weighted_mean(y, weights, n), values.shape).copy()
+        scale = np.abs(x).max(axis=1, keepdims=True)
+        p1 = x / np.where(scale > 0, scale, 1)
+        norm1 = (weights * p1 ** 2).sum(axis=1, keepdims=True)
+        p2 = p1 ** 2 - _weighted_mean(p1 ** 2, weights, n)
+        p2 = np.where(observed, p2 - p1 * (weights * p1 ** 3).sum(axis=1, keepdims=True) / np.where(norm1 > 0, norm1, 1), 0)
+        norm2 = (weights * p2 ** 2).sum(axis=1, keepdims=True)
+
+        # Projection of the yields on every polynomial, left out if it vanishes on the observed years
+        for p, norm in ((p1, norm1), (p2, norm2)):
+            independent = norm > 1e-10 * n
+            fitted += np.where(independent, (weights * y * p).sum(axis=1, keepdims=True) / np.where(independent, norm, 1), 0) * p
+    return np.where(observed, fitted, np.nan)
+
+
+def detrend(table, value, groups, suffix, floor=None, distinct=False):
+    # INPUT:
+    # - table: dataframe in long format with the yields (value), the year and the group columns (one row per group and
+    #   year, several rows of a year are all counted as in lm). The other columns are kept (and checked for missing
+    #   values, as na.omit in the notebook).
+    # - value: name of the yield column (e.g. "yield", "tot_yld", "aggregated_yield_obs")
+    # - groups: names of the columns of a group (e.g. ["lon", "lat"] for GDHY, ["lon", "lat", "model"] for the
+    #   simulations)
+    # - suffix: suffix of the new columns (e.g. "obs" or "sim")
+    # - floor: None for the crop specific yields (divtrend = value / pmax(.fitted, 0), difftrend = value - .fitted),
+    #   or the lower bound of .fitted for both (AGGR_FLOOR for the crop aggregate)
+    # - distinct: count identical rows once (distinct() of the notebook, only for the GDHY panels, whose rows are
+    #   repeated for every model)
+    # OUTPUT:
+    # - dataframe with the rows of the fitted groups with a nonzero yield and the columns .fitted,
+    #   divtrend_<suffix>, difftrend_<suffix> and log_divtrend_<suffix>
+
+    table = table.dropna()
+    if distinct:
+        table = table.drop_duplicates()
+    table = table.copy()
+    table["year"] = pd.to_numeric(table["year"])
+    table = table[table.groupby(list(groups))[value].transform("size") > 2].reset_index(drop=True)
+
+    # (group, year) matrix of the panel: mean and number of the rows of every group and year
+    group = table.groupby(list(groups), sort=False).ngroup().values
+    years, column = np.unique(table["year"].values, return_inverse=True)
+    shape = (group.max() + 1 if len(group) else 0, len(years))
+    counts = np.zeros(shape)
+    np.add.at(counts, (group, column), 1)
+    sums = np.zeros(shape)
+    np.add.at(sums, (group, column), table[value].values)
+    with np.errstate(invalid="ignore"):
+        values = np.where(counts > 0, sums / counts, np.nan)
+
+    fitted = quadratic_fit(values, years, counts)[group, column]
+    if floor is not None:
+        fitted = np.maximum(fitted, floor)
+    table[".fitted"] = fitted
+    with np.errstate(divide="ignore", invalid="ignore"):
+        table[f"divtrend_{suffix}"] = table[value] / np.maximum(fitted, 0)
+    table[f"difftrend_{suffix}"] = table[value] - fitted
+    table = table[table[value] != 0].reset_index(drop=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        table[f"log_divtrend_{suffix}"] = np.log(table[f"divtrend_{suffix}"])
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python detrending.py", description="Quadratic detrending of a yield panel.")
+    parser.add_argument("input", help="csv file with one row per group and year")
+    parser.add_argument("output", help="csv file for the detrended table")
+    parser.add_argument("--value", required=True, help="yield column (e.g. yield, tot_yld, aggregated_yield_sim)")
+    parser.add_argument("--groups", nargs="+", default=("lon", "lat"), help="group columns (default: lon lat)")
+    parser.add_argument("--suffix", required=True, help="suffix of the detrended columns (e.g. obs, sim)")
+    parser.add_argument("--aggr", action="store_true", help=f"crop aggregate: pmax(.fitted, {AGGR_FLOOR:g}) in both detrended yields")
+    parser.add_argument("--distinct", action="store_true", help="count identical rows once (GDHY panels, as distinct() in the notebook)")
+    args = parser.parse_args(argv)
+
+    table = pd.read_csv(args.input)
+    detrend(table, args.value, args.groups, args.suffix, AGGR_FLOOR if args.aggr else None, args.distinct).to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()